@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File        : BtBam.py
+Author      : Dominik R. Laetsch, dominik.laetsch at gmail dot com
+
+Native reader for BGZF compressed BAM files. Blocks are inflated with zlib
+(which releases the GIL, so blocks can be inflated on a pool of threads) and
+alignment records are decoded from their binary representation, so that no
+'samtools view' text has to be formatted and parsed again.
+"""
+
+from __future__ import division
+import struct
+import zlib
+from multiprocessing.pool import ThreadPool
+from os.path import isfile, splitext, getsize
+import bloblib.BtLog as BtLog
+import bloblib.BtCov as BtCov
+
+# CONSTs
+BGZF_MAGIC = '\x1f\x8b\x08\x04'
+BAM_MAGIC = 'BAM\x01'
+BAI_MAGIC = 'BAI\x01'
+BAI_PSEUDO_BIN = 37450 # holds reference span and mapped/unmapped counts
+BLOCK_BATCH = 16 # number of BGZF blocks inflated per thread and batch
+INT32 = struct.Struct('<i')
+UINT32 = struct.Struct('<I')
+UINT64 = struct.Struct('<Q')
+BGZF_HEADER = struct.Struct('<4sI2BH') # magic, mtime, xfl, os, xlen
+BGZF_SUBFIELD = struct.Struct('<2BH') # si1, si2, slen
+# refID, pos, l_read_name, mapq, bin, n_cigar_op, flag, l_seq
+ALIGNMENT_CORE = struct.Struct('<iiBBHHHi')
+ALIGNMENT_CORE_SIZE = 32 # incl. next_refID, next_pos and tlen
+SEQ_CODES = '=ACMGRSVTWYHKDBN'
+FLAG_COUNT = 4096 # flags are 12 bit, flag_counts are indexed by flag
+TAG_TYPES = {'c' : '<b', 'C' : '<B', 's' : '<h', 'S' : '<H', 'i' : '<i', 'I' : '<I', 'f' : '<f'}
+
+def inflateBlock(block):
+    coffset, cdata = block
+    return coffset, zlib.decompress(cdata, -15)
+
+class BgzfReader():
+    '''
+    Reads BGZF blocks from a file and yields their inflated data together
+    with the file offset of the block.
+    '''
+    def __init__(self, infile, threads=1):
+        self.f = infile
+        self.fh = open(infile, 'rb')
+        self.pool = ThreadPool(threads) if threads > 1 else None
+        self.batch = threads * BLOCK_BATCH if threads > 1 else 1
+
+    def readRawBlock(self):
+        coffset = self.fh.tell()
+        header = self.fh.read(BGZF_HEADER.size)
+        if not header:
+            return None
+        if len(header) < BGZF_HEADER.size:
+            print BtLog.warn_d['11']
+            return None
+        magic, mtime, xfl, os, xlen = BGZF_HEADER.unpack(header)
+        if not magic == BGZF_MAGIC:
+            BtLog.error('37', self.f, 'BGZF')
+        extra = self.fh.read(xlen)
+        bsize, i = None, 0
+        while i < xlen:
+            si1, si2, slen = BGZF_SUBFIELD.unpack_from(extra, i)
+            if si1 == 66 and si2 == 67: # 'BC' subfield holds the block size
+                bsize = struct.unpack_from('<H', extra, i + 4)[0]
+            i += BGZF_SUBFIELD.size + slen
+        if bsize is None:
+            BtLog.error('37', self.f, 'BGZF')
+        cdata = self.fh.read(bsize - xlen - 19)
+        self.fh.read(8) # CRC32, ISIZE
+        return coffset, cdata
+
+    def blocks(self):
+        while True:
+            raw_blocks = []
+            while len(raw_blocks) < self.batch:
+                raw_block = self.readRawBlock()
+                if raw_block is None:
+                    break
+                raw_blocks.append(raw_block)
+            if not raw_blocks:
+                break
+            if (self.pool):
+                for block in self.pool.map(inflateBlock, raw_blocks):
+                    yield block
+            else:
+                for raw_block in raw_blocks:
+                    yield inflateBlock(raw_block)
+            if len(raw_blocks) < self.batch:
+                break
+
+    def seek(self, coffset):
+        self.fh.seek(coffset)
+
+    def close(self):
+        if (self.pool):
+            self.pool.close()
+        self.fh.close()
+
+class BamReader():
+    '''
+    Parses the BAM header on initialisation (self.header, self.references)
+    and yields the core fields of alignment records through alignments().
+    Counts of each flag are kept in self.flag_counts. If progress is set,
+    progress is reported based on the offset of the current BGZF block.
+    '''
+    def __init__(self, infile, threads=1, progress=False, sample_fraction=None):
+        if not isfile(infile):
+            BtLog.error('0', infile)
+        self.f = infile
+        self.bgzf = BgzfReader(infile, threads)
+        self.blocks = self.bgzf.blocks()
+        self.buf = ''
+        self.pos = 0
+        self.flag_counts = [0] * FLAG_COUNT
+        self.progress = progress
+        self.size = getsize(infile)
+        self.percent = 0
+        self.header = ''
+        self.references = [] # list of (name, length) tuples, index is refID
+        self.cigar_decoder = BtCov.CigarDecoder()
+        # alignments of reads not sampled are skipped (but their flags are counted)
+        self.sample_threshold = BtCov.getSampleThreshold(sample_fraction) if (sample_fraction) else None
+        self.readHeader()
+
+    def readBytes(self, size):
+        while len(self.buf) - self.pos < size:
+            try:
+                coffset, data = next(self.blocks)
+            except StopIteration:
+                BtLog.error('37', self.f, 'BAM')
+            self.buf = self.buf[self.pos:] + data
+            self.pos = 0
+        data = self.buf[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def readInt(self):
+        return INT32.unpack(self.readBytes(4))[0]
+
+    def readHeader(self):
+        if not self.readBytes(4) == BAM_MAGIC:
+            BtLog.error('37', self.f, 'BAM')
+        self.header = self.readBytes(self.readInt())
+        for i in xrange(self.readInt()):
+            name = self.readBytes(self.readInt())[:-1] # NUL-terminated
+            length = self.readInt()
+            self.references.append((name, length))
+
+    def alignments(self, only_ref_id=None):
+        '''
+        Yields (ref_id, pos, mapq, flag, cigar) for each alignment record,
+        cigar being the packed (uint32 little-endian) CIGAR operations
+        If only_ref_id is given, stops at the first alignment of another
+        reference (which is not counted)
+        '''
+        unpack_int = INT32.unpack_from
+        unpack_core = ALIGNMENT_CORE.unpack_from
+        flag_counts = self.flag_counts
+        sample_threshold = self.sample_threshold
+        buf, pos = self.buf, self.pos
+        while True:
+            end = len(buf)
+            while pos + 4 <= end:
+                block_size = unpack_int(buf, pos)[0]
+                if pos + 4 + block_size > end:
+                    break
+                ref_id, ref_pos, l_read_name, mapq, _bin, n_cigar_op, flag, l_seq = unpack_core(buf, pos + 4)
+                if only_ref_id is not None and not ref_id == only_ref_id:
+                    self.buf, self.pos = '', 0
+                    return
+                flag_counts[flag] += 1
+                name_start = pos + 4 + ALIGNMENT_CORE_SIZE
+                if sample_threshold is None or BtCov.isSampled(buf[name_start:name_start + l_read_name - 1], sample_threshold):
+                    cigar_start = name_start + l_read_name
+                    yield ref_id, ref_pos, mapq, flag, buf[cigar_start:cigar_start + 4 * n_cigar_op]
+                pos += 4 + block_size
+            try:
+                coffset, data = next(self.blocks)
+            except StopIteration:
+                break
+            if (self.progress):
+                self.reportProgress(coffset)
+            buf = buf[pos:] + data
+            pos = 0
+        if pos < len(buf):
+            print BtLog.warn_d['11']
+        if (self.progress):
+            self.reportProgress(self.size)
+        self.buf, self.pos = '', 0
+
+    def samAlignments(self):
+        '''
+        Yields the fields of each alignment record as formatted by 'samtools view'
+        (qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual, tags ...)
+        '''
+        for record in self.records():
+            yield self.formatRecord(record)
+
+    def records(self):
+        '''
+        Yields each alignment record (without block_size)
+        '''
+        unpack_int = INT32.unpack_from
+        flag_counts = self.flag_counts
+        buf, pos = self.buf, self.pos
+        while True:
+            end = len(buf)
+            while pos + 4 <= end:
+                block_size = unpack_int(buf, pos)[0]
+                if pos + 4 + block_size > end:
+                    break
+                record = buf[pos + 4:pos + 4 + block_size]
+                flag_counts[struct.unpack_from('<H', record, 14)[0]] += 1
+                yield record
+                pos += 4 + block_size
+            try:
+                coffset, data = next(self.blocks)
+            except StopIteration:
+                break
+            if (self.progress):
+                self.reportProgress(coffset)
+            buf = buf[pos:] + data
+            pos = 0
+        if pos < len(buf):
+            print BtLog.warn_d['11']
+        if (self.progress):
+            self.reportProgress(self.size)
+        self.buf, self.pos = '', 0
+
+    def formatRecord(self, record):
+        ref_id, ref_pos, l_read_name, mapq, _bin, n_cigar_op, flag, l_seq = ALIGNMENT_CORE.unpack_from(record, 0)
+        next_ref_id, next_pos, tlen = struct.unpack_from('<3i', record, 20)
+        pos = ALIGNMENT_CORE_SIZE
+        qname = record[pos:pos + l_read_name - 1]
+        pos += l_read_name
+        cigar = record[pos:pos + 4 * n_cigar_op]
+        pos += 4 * n_cigar_op
+        seq = record[pos:pos + (l_seq + 1) // 2]
+        pos += (l_seq + 1) // 2
+        qual = record[pos:pos + l_seq]
+        pos += l_seq
+        fields = [
+            qname,
+            str(flag),
+            self.references[ref_id][0] if ref_id >= 0 else '*',
+            str(ref_pos + 1),
+            str(mapq),
+            self.cigar_decoder.cigarString(cigar),
+            '*' if next_ref_id < 0 else ('=' if next_ref_id == ref_id else self.references[next_ref_id][0]),
+            str(next_pos + 1),
+            str(tlen),
+            "".join([SEQ_CODES[ord(byte) >> 4] + SEQ_CODES[ord(byte) & 15] for byte in seq])[:l_seq] if l_seq else '*',
+            "".join([chr(ord(q) + 33) for q in qual]) if l_seq and not qual[0] == '\xff' else '*'
+            ]
+        fields.extend(formatTags(record, pos))
+        return fields
+
+    def reportProgress(self, coffset):
+        percent = int(coffset * 100 / self.size) if self.size else 100
+        if percent > self.percent or percent == 100:
+            self.percent = percent
+            BtLog.progress(percent, 1, 100)
+
+    def isCoordinateSorted(self):
+        for line in self.header.split("\n"):
+            if line.startswith("@HD"):
+                return "SO:coordinate" in line.split("\t")
+        return False
+
+    def seek(self, voffset):
+        '''
+        Positions the reader at a virtual file offset (coffset << 16 | uoffset)
+        '''
+        self.bgzf.seek(voffset >> 16)
+        self.blocks = self.bgzf.blocks()
+        self.buf, self.pos = '', 0
+        self.readBytes(voffset & 0xffff)
+
+    def fetch(self, ref_id, voffset):
+        '''
+        Returns alignments() of reference ref_id, starting at virtual offset
+        voffset (as given by BamIndex.getStart()), requires coordinate sorted BAM
+        '''
+        self.seek(voffset)
+        return self.alignments(ref_id)
+
+    def close(self):
+        self.bgzf.close()
+
+class BamIndex():
+    '''
+    Parses a BAI index. For each reference, the chunks of its bins and the
+    content of its pseudo-bin (virtual offsets spanning the reference, number
+    of mapped and unmapped reads) are kept.
+    '''
+    def __init__(self, infile):
+        if not isfile(infile):
+            BtLog.error('0', infile)
+        self.f = infile
+        self.chunks = [] # per refID, list of (beg, end) virtual offsets
+        self.meta = [] # per refID, (ref_beg, ref_end, n_mapped, n_unmapped) or None
+        self.n_no_coor = 0
+        self.readIndex()
+
+    def readIndex(self):
+        with open(self.f, 'rb') as fh:
+            data = fh.read()
+        if not data[0:4] == BAI_MAGIC:
+            BtLog.error('37', self.f, 'BAI')
+        n_ref = INT32.unpack_from(data, 4)[0]
+        pos = 8
+        for ref_id in xrange(n_ref):
+            chunks, meta = [], None
+            n_bin = INT32.unpack_from(data, pos)[0]
+            pos += 4
+            for i in xrange(n_bin):
+                _bin = UINT32.unpack_from(data, pos)[0]
+                n_chunk = INT32.unpack_from(data, pos + 4)[0]
+                pos += 8
+                offsets = struct.unpack_from('<%dQ' % (2 * n_chunk), data, pos)
+                pos += 16 * n_chunk
+                if _bin == BAI_PSEUDO_BIN:
+                    meta = offsets[0:4]
+                else:
+                    chunks.extend(zip(offsets[0::2], offsets[1::2]))
+            n_intv = INT32.unpack_from(data, pos)[0]
+            pos += 4 + 8 * n_intv
+            self.chunks.append(chunks)
+            self.meta.append(meta)
+        if pos + 8 <= len(data):
+            self.n_no_coor = UINT64.unpack_from(data, pos)[0]
+
+    def getStart(self, ref_id):
+        '''
+        Returns virtual offset of first alignment of reference ref_id or None
+        if no alignments are placed on it
+        '''
+        if (self.meta[ref_id]):
+            return self.meta[ref_id][0]
+        if (self.chunks[ref_id]):
+            return min([beg for beg, end in self.chunks[ref_id]])
+        return None
+
+def formatTags(record, pos):
+    tags = []
+    while pos < len(record):
+        tag, val_type = record[pos:pos + 2], record[pos + 2]
+        pos += 3
+        if val_type == 'A':
+            tags.append("%s:A:%s" % (tag, record[pos]))
+            pos += 1
+        elif val_type in 'ZH':
+            end = record.index('\x00', pos)
+            tags.append("%s:%s:%s" % (tag, val_type, record[pos:end]))
+            pos = end + 1
+        elif val_type == 'B':
+            sub_type = record[pos]
+            count = INT32.unpack_from(record, pos + 1)[0]
+            pos += 5
+            fmt = TAG_TYPES[sub_type]
+            size = struct.calcsize(fmt)
+            values = struct.unpack_from('<%d%s' % (count, fmt[1]), record, pos)
+            pos += size * count
+            tags.append("%s:B:%s" % (tag, ",".join([sub_type] + [str(value) for value in values])))
+        else:
+            fmt = TAG_TYPES[val_type]
+            value = struct.unpack_from(fmt, record, pos)[0]
+            pos += struct.calcsize(fmt)
+            tags.append("%s:%s:%s" % (tag, 'f' if val_type == 'f' else 'i', value))
+    return tags
+
+def getFlagStats(flag_counts):
+    '''
+    Returns the counts reported by 'samtools flagstat' (total, mapped,
+    secondary, supplementary, duplicates) from counts of each flag
+    '''
+    flag_stats = {'total' : 0, 'mapped' : 0, 'secondary' : 0, 'supplementary' : 0, 'duplicates' : 0}
+    for flag, count in enumerate(flag_counts):
+        if (count):
+            flag_stats['total'] += count
+            if not flag & 4:
+                flag_stats['mapped'] += count
+            if flag & 256:
+                flag_stats['secondary'] += count
+            if flag & 2048:
+                flag_stats['supplementary'] += count
+            if flag & 1024:
+                flag_stats['duplicates'] += count
+    return flag_stats
+
+def getIndexFile(infile):
+    for index_f in [infile + '.bai', splitext(infile)[0] + '.bai']:
+        if isfile(index_f):
+            return index_f
+    return None
+
+if __name__ == "__main__":
+    pass
@@ -10,7 +10,9 @@ from __future__ import division
 import bloblib.BtLog as BtLog
 import bloblib.BtIO as BtIO
 import bloblib.BtTax as BtTax
-from os.path import abspath, isfile, basename, isdir, join
+import bloblib.BtCov as BtCov
+import bloblib.BtNodes as BtNodes
+from os.path import abspath, isfile, basename, isdir, join, exists
 from os import getcwd, mkdir
 import json
 
@@ -34,6 +36,7 @@ class BlobDb():
         self.taxrules = []
         self.version = ''
         self.view_dir = ''
+        self.windows = {} # GC, N count and coverage in windows along sequences, see parseFasta
 
     def view(self, **kwargs):
         # arguments
@@ -61,6 +64,9 @@ class BlobDb():
                 viewObj.header = self.getConcoctCovHeader(cov_lib_names)
             if viewObj.name == 'covlib':
                 viewObj.header = self.getCovHeader(cov_lib_names)
+            if viewObj.name == 'windows':
+                viewObj.header = self.getWindowsHeader()
+                blob_idxs = {name : idx for idx, name in enumerate(self.order_of_blobs)}
             if viewObj.name == 'experimental':
                 viewObj.covs = {cov_lib : [] for cov_lib in cov_lib_names}
                 viewObj.covs["covsum"] = []
@@ -95,6 +101,8 @@ class BlobDb():
                         viewObj.body[rank].append(self.getConcoctTaxLine(blob, rank, taxrule))
                 if viewObj.name == 'covlib':
                     viewObj.body.append(self.getCovLine(blob, cov_lib_names))
+                if viewObj.name == 'windows':
+                    viewObj.body.append(self.getWindowsLines(blob, blob_idxs[seq]))
         if (progress_bar):
             BtLog.progress(len(seqs), 1000, len(seqs))
         for viewObj in viewObjs:
@@ -126,6 +134,23 @@ class BlobDb():
             # BlobObj turned dict
             return "%s\t%s\t%s\n" % (blob['name'], blob['read_cov'][cov_lib_names[0]], blob['covs'][cov_lib_names[0]])
 
+    def getWindowsHeader(self):
+        header = '## %s\n' % (self.version)
+        header += "## window size\t: %s\n" % (self.windows['size'])
+        header += "# %s\n" % "\t".join(["name", "start", "end", "GC", "N"] + sorted(self.windows['covs']))
+        return header
+
+    def getWindowsLines(self, blob, blob_idx):
+        lines = ''
+        window_size = self.windows['size']
+        cov_lib_names = sorted(self.windows['covs'])
+        for window_idx in xrange(self.windows['offsets'][blob_idx], self.windows['offsets'][blob_idx + 1]):
+            start = (window_idx - self.windows['offsets'][blob_idx]) * window_size
+            fields = [blob['name'], start, min(start + window_size, blob['length']), self.windows['gc'][window_idx], self.windows['n_count'][window_idx]]
+            fields += [self.windows['covs'][cov_lib_name][window_idx] for cov_lib_name in cov_lib_names]
+            lines += "%s\n" % "\t".join(map(str, fields))
+        return lines
+
     def getConcoctCovHeader(self, cov_lib_names):
         return "contig\t%s\n" % "\t".join(cov_lib_names)
 
@@ -171,7 +196,8 @@ class BlobDb():
         line += sep
         line += "%s" % sep.join(map(str, [ blob['covs'][covLib] for covLib in cov_lib_names]))
         if len(cov_lib_names) > 1:
-            line += "%s%s" % (sep, sum([ blob['covs'][covLib] for covLib in cov_lib_names]))
+            # libraries of filter profiles are subsets of other libraries and are not summed
+            line += "%s%s" % (sep, sum([ blob['covs'][covLib] for covLib in cov_lib_names if not self.covLibs[covLib].get('profile', None)]))
         for rank in ranks:
             line += sep
             tax, score, c_index = 'N/A', 'N/A', 'N/A'
@@ -200,15 +226,17 @@ class BlobDb():
                 'assembly_f' : self.assembly_f,
                 'lineages' : self.lineages,
                 'order_of_blobs' : self.order_of_blobs,
-                'dict_of_blobs' : {name : blObj.__dict__ for name, blObj in self.dict_of_blobs.items()},
+                # BlobDBs read by load() hold dicts instead of objects
+                'dict_of_blobs' : {name : getattr(blObj, '__dict__', blObj) for name, blObj in self.dict_of_blobs.items()},
                 'length' : self.length,
                 'seqs' : self.seqs,
                 'n_count' : self.n_count,
                 'nodesDB_f' : self.nodesDB_f,
-                'covLibs' : {name : covLibObj.__dict__ for name, covLibObj in self.covLibs.items()},
-                'hitLibs' : {name : hitLibObj.__dict__ for name, hitLibObj in self.hitLibs.items()},
+                'covLibs' : {name : getattr(covLibObj, '__dict__', covLibObj) for name, covLibObj in self.covLibs.items()},
+                'hitLibs' : {name : getattr(hitLibObj, '__dict__', hitLibObj) for name, hitLibObj in self.hitLibs.items()},
                 'taxrules' : self.taxrules,
-                'version' : self.version
+                'version' : self.version,
+                'windows' : self.windows
                 }
         return dump
 
@@ -225,12 +253,14 @@ class BlobDb():
         min_cov = 1000.0
         cov_lib_dict = self.covLibs
         cov_lib_names_l = self.covLibs.keys() # does not include cov_sum
-        if len(cov_lib_names_l) > 1:
+        # libraries of filter profiles are subsets of other libraries and are not summed
+        sum_cov_lib_names = set([x for x in cov_lib_names_l if not self.covLibs[x].get('profile', None)])
+        if len(sum_cov_lib_names) > 1:
             # more than one cov_lib, cov_sum_lib has to be created
             cov_lib_dict['covsum'] = CovLibObj('covsum', 'covsum', 'Sum of cov in %s' % basename(self.title)).__dict__ # ugly
-            cov_lib_dict['covsum']['reads_total'] = sum([self.covLibs[x]['reads_total'] for x in self.covLibs])
-            cov_lib_dict['covsum']['reads_mapped'] = sum([self.covLibs[x]['reads_mapped'] for x in self.covLibs])
-            cov_lib_dict['covsum']['cov_sum'] = sum([self.covLibs[x]['cov_sum'] for x in self.covLibs])
+            cov_lib_dict['covsum']['reads_total'] = sum([self.covLibs[x]['reads_total'] for x in sum_cov_lib_names])
+            cov_lib_dict['covsum']['reads_mapped'] = sum([self.covLibs[x]['reads_mapped'] for x in sum_cov_lib_names])
+            cov_lib_dict['covsum']['cov_sum'] = sum([self.covLibs[x]['cov_sum'] for x in sum_cov_lib_names])
             cov_lib_dict['covsum']['mean_cov'] = cov_lib_dict['covsum']['cov_sum']/self.seqs
         for blob in self.dict_of_blobs.values():
             name, gc, length, group = blob['name'], blob['gc'], blob['length'], ''
@@ -284,13 +314,15 @@ class BlobDb():
                         max_cov = cov
                     # add cov of blob to group
                     data_dict[group]['covs'][cov_lib].append(cov)
-                    cov_sum += cov
+                    if cov_lib in sum_cov_lib_names:
+                        cov_sum += cov
                     # add readcov
                     if cov_lib in blob['read_cov']:
                         reads_mapped = blob['read_cov'][cov_lib]
                         data_dict[group]['reads_mapped'][cov_lib] += reads_mapped
-                        reads_mapped_sum += reads_mapped
-                if len(cov_lib_names_l) > 1:
+                        if cov_lib in sum_cov_lib_names:
+                            reads_mapped_sum += reads_mapped
+                if len(sum_cov_lib_names) > 1:
                     if cov_sum < 0.02 :
                         cov_sum = 0.02
                     data_dict[group]['covs']['covsum'].append(cov_sum)
@@ -306,15 +338,61 @@ class BlobDb():
         for blObj in self.dict_of_blobs.values():
             blObj.addCov(covLib.name, 0.0)
 
-    def parseFasta(self, fasta_f, fasta_type):
+    def parseDepth(self, covLib):
+        '''
+        Adds a cov lib <covLib.name>.<idx> for each sample of a multi-sample
+        depth file (see BtIO.parseDepth), parsed in a single pass. Coverage
+        (mean depth) of all sequences and samples is computed as one matrix
+        and added to each BlObj at once. Source of each cov lib is the label
+        of its sample ('samtools depth -H') or the depth file, shared by all
+        samples, so each cov lib keeps its name as 'sample'. Depth files have
+        no read counts, so reads (total, mapped and per sequence) are 0
+        '''
+        import numpy
+        print BtLog.status_d['1'] % (covLib.name, covLib.f)
+        labels, depth_matrix = BtIO.parseDepth(covLib.f, self.order_of_blobs)
+        if depth_matrix is None:
+            print BtLog.warn_d['4'] % covLib.f
+            return
+        agct_counts = numpy.array([self.dict_of_blobs[name].agct_count for name in self.order_of_blobs], dtype=numpy.float64)
+        cov_matrix = depth_matrix / numpy.maximum(agct_counts, 1)[:, None]
+        cov_lib_names = ['%s.%s' % (covLib.name, idx) for idx in xrange(cov_matrix.shape[1])]
+        for name, covs in zip(self.order_of_blobs, numpy.round(cov_matrix, 3).tolist()):
+            self.dict_of_blobs[name].covs.update(zip(cov_lib_names, covs))
+            self.dict_of_blobs[name].read_cov.update((cov_lib_name, 0) for cov_lib_name in cov_lib_names)
+        for idx, cov_sum in enumerate(cov_matrix.sum(axis=0).tolist()):
+            depthLib = CovLibObj(cov_lib_names[idx], covLib.fmt, labels[idx] if (labels) else covLib.f)
+            depthLib.sample = depthLib.name
+            depthLib.cov_sum = cov_sum
+            depthLib.mean_cov = cov_sum / self.seqs
+            if cov_sum == 0.0:
+                print BtLog.warn_d['6'] % (depthLib.name)
+            self.covLibs[depthLib.name] = depthLib
+
+    def parseFasta(self, fasta_f, fasta_type, window_size=None, threads=1):
+        '''
+        window_size: GC and N count are computed in windows of window_size
+        along sequences (and coverage of BAM/SAM files in parseCoverage).
+        Windows are stored in flat lists, windows of the n-th sequence in
+        order_of_blobs are at indices offsets[n] to offsets[n + 1]
+        threads: without windows, byte ranges of the FASTA file are parsed
+        by 'threads' processes (see BtIO.readFastaStatsParallel)
+        '''
         print BtLog.status_d['1'] % ('FASTA', fasta_f)
         self.assembly_f = abspath(fasta_f)
         if (fasta_type):
             # Set up CovLibObj for coverage in assembly header
             self.covLibs[fasta_type] = CovLibObj(fasta_type, fasta_type, fasta_f)
+        if (window_size):
+            self.windows = {'size' : window_size, 'offsets' : [0], 'gc' : [], 'n_count' : [], 'covs' : {}}
 
-        for name, seq in BtIO.readFasta(fasta_f):
-            blObj = BlObj(name, seq)
+        # sequences are only read into memory if windows are computed
+        if (window_size):
+            fasta = ((name, seq, BtIO.getSeqStats(seq)) for name, seq in BtIO.readFasta(fasta_f))
+        else:
+            fasta = ((name, None, stats) for name, stats in BtIO.readFastaStatsParallel(fasta_f, threads))
+        for name, seq, stats in fasta:
+            blObj = BlObj(name, stats)
             if not blObj.name in self.dict_of_blobs:
                 self.seqs += 1
                 self.length += blObj.length
@@ -327,26 +405,97 @@ class BlobDb():
 
                 self.order_of_blobs.append(blObj.name)
                 self.dict_of_blobs[blObj.name] = blObj
+
+                if (window_size):
+                    gcs, n_counts = BtCov.getSeqWindowStats(seq, window_size)
+                    self.windows['gc'].extend(gcs)
+                    self.windows['n_count'].extend(n_counts)
+                    self.windows['offsets'].append(len(self.windows['gc']))
             else:
                 BtLog.error('5', blObj.name)
 
         if self.seqs == 0 or self.length == 0:
             BtLog.error('1')
 
+    def parseCovLibs(self, covLibObjs, no_base_cov, threads, cov_stats=False, window_size=None, sample_fraction=None, profiles=None, seqs=None):
+        '''
+        Parses BAM/SAM/PAF/FASTQ/CAS files of covLibObjs, using a pool of 'threads'
+        processes if there is more than one file. A library read from STDIN
+        is parsed by this process (STDIN of pool processes is /dev/null)
+        while the pool parses the others. If seqs is given, only the
+        alignments to these sequences are fetched from (indexed) BAM files.
+        Returns dict of covLib.name : (cov_dict, reads_total, reads_mapped, read_cov_dict[, cov_stats_dict, base_cov_ci_dict, profile_cov_dict])
+        '''
+        profiles = profiles or []
+        tasks = []
+        # lengths of sequences are only needed for depth statistics/windows
+        blob_lengths = {name : blObj.length for name, blObj in self.dict_of_blobs.items()} if (cov_stats or window_size) else None
+        for covLib in covLibObjs:
+            print BtLog.status_d['1'] % (covLib.name, covLib.f)
+            blobs = self.order_of_blobs if covLib.fmt == 'cas' else set(self.dict_of_blobs if seqs is None else seqs)
+            tasks.append((covLib.fmt, covLib.f, blobs, no_base_cov, threads, blob_lengths, window_size, sample_fraction, profiles, seqs is not None, self.assembly_f))
+        stdin_tasks = [task for task in tasks if task[1] == '-']
+        if len(stdin_tasks) > 1:
+            BtLog.error('44')
+        file_tasks = [task for task in tasks if not task[1] == '-']
+        if threads > 1 and len(file_tasks) > 1:
+            from multiprocessing import Pool
+            # libraries are parsed concurrently, each one by a single process
+            file_tasks = [task[:4] + (1,) + task[5:] for task in file_tasks]
+            pool = Pool(min(threads, len(file_tasks)))
+            async_results = pool.map_async(parseCovLib, file_tasks)
+            stdin_results = [parseCovLib(task) for task in stdin_tasks]
+            file_results = async_results.get()
+            pool.close()
+            pool.join()
+        else:
+            stdin_results = [parseCovLib(task) for task in stdin_tasks]
+            file_results = [parseCovLib(task) for task in file_tasks]
+        results = []
+        for task in tasks:
+            results.append(stdin_results.pop(0) if task[1] == '-' else file_results.pop(0))
+        if None in results: # error while parsing
+            exit(1)
+        return {covLib.name : result for covLib, result in zip(covLibObjs, results)}
+
     def parseCoverage(self, **kwargs):
         # arguments
         covLibObjs = kwargs['covLibObjs']
         no_base_cov = kwargs['no_base_cov']
-
+        threads = kwargs['threads']
+        cov_stats = kwargs.get('cov_stats', False)
+        window_size = self.windows.get('size', None)
+        sample_fraction = kwargs.get('sample_fraction', None)
+        profiles = kwargs.get('profiles', [])
+        seqs = kwargs.get('seqs', None) # subset of sequences, written to COV files
+
+        parsed_covLibs = self.parseCovLibs([covLib for covLib in covLibObjs if covLib.fmt in ['bam', 'sam', 'paf', 'fastq', 'cas']], no_base_cov, threads, cov_stats, window_size, sample_fraction, profiles, seqs)
+        # each filter profile of a BAM/SAM file becomes a library of its own (e.g. bam0.q30)
+        profile_covLibObjs = []
         for covLib in covLibObjs:
-            self.addCovLib(covLib)
-            print BtLog.status_d['1'] % (covLib.name, covLib.f)
+            profile_covLibObjs.append(covLib)
             if covLib.fmt == 'bam' or covLib.fmt == 'sam':
-                base_cov_dict = {}
-                if covLib.fmt == 'bam':
-                    base_cov_dict, covLib.reads_total, covLib.reads_mapped, read_cov_dict = BtIO.parseBam(covLib.f, set(self.dict_of_blobs), no_base_cov)
-                else:
-                    base_cov_dict, covLib.reads_total, covLib.reads_mapped, read_cov_dict = BtIO.parseSam(covLib.f, set(self.dict_of_blobs), no_base_cov)
+                base_cov_dict, reads_total, reads_mapped, read_cov_dict, cov_stats_dict, base_cov_ci_dict, profile_cov_dict = parsed_covLibs[covLib.name]
+                for profile in profiles:
+                    profileLib = CovLibObj('%s.%s' % (covLib.name, profile), covLib.fmt, covLib.f)
+                    profileLib.profile = profile
+                    profile_base_cov_dict, profile_read_cov_dict, profile_base_cov_ci_dict = profile_cov_dict[profile]
+                    parsed_covLibs[profileLib.name] = (profile_base_cov_dict, reads_total, reads_mapped, profile_read_cov_dict, {}, profile_base_cov_ci_dict, {})
+                    profile_covLibObjs.append(profileLib)
+        for covLib in profile_covLibObjs:
+            if covLib.fmt == 'depth':
+                # one cov lib per sample, all added by parseDepth
+                self.parseDepth(covLib)
+                continue
+            self.addCovLib(covLib)
+            if covLib.fmt in ['bam', 'sam', 'paf', 'fastq']:
+                base_cov_dict, covLib.reads_total, covLib.reads_mapped, read_cov_dict, cov_stats_dict, base_cov_ci_dict, profile_cov_dict = parsed_covLibs[covLib.name]
+                if (base_cov_ci_dict):
+                    # coverage was estimated from sampled reads
+                    covLib.sample_fraction = sample_fraction
+                    for name, (lower, upper) in base_cov_ci_dict.items():
+                        agct_count = self.dict_of_blobs[name].agct_count
+                        covLib.cov_ci[name] = [float("{0:.3f}".format(lower / agct_count)), float("{0:.3f}".format(upper / agct_count))]
 
                 if covLib.reads_total == 0:
                     print BtLog.warn_d['4'] % covLib.f
@@ -356,13 +505,21 @@ class BlobDb():
                     covLib.cov_sum += cov
                     self.dict_of_blobs[name].addCov(covLib.name, cov)
                     self.dict_of_blobs[name].addReadCov(covLib.name, read_cov_dict[name])
+                if (window_size) and (cov_stats_dict):
+                    # windows are only computed for all alignments of BAM/SAM/PAF libraries
+                    self.windows['covs'][covLib.name] = []
+                    for name in self.order_of_blobs:
+                        self.windows['covs'][covLib.name].extend(cov_stats_dict[name].pop('windows'))
+                if (cov_stats):
+                    for name, blob_cov_stats in cov_stats_dict.items():
+                        self.dict_of_blobs[name].addCovStats(covLib.name, blob_cov_stats)
                 # Create COV file for future use
-                out_f = BtIO.getOutFile(covLib.f, None, None)
+                out_f = getCovOutFile(covLib, seqs is not None)
                 covView = ViewObj(name="covlib", out_f=out_f, suffix="cov", header="", body=[])
-                self.view(viewObjs=[covView], ranks=None, taxrule=None, hits_flag=None, seqs=None, cov_libs=[covLib.name], progressbar=False)
+                self.view(viewObjs=[covView], ranks=None, taxrule=None, hits_flag=None, seqs=seqs, cov_libs=[covLib.name], progressbar=False)
 
             elif covLib.fmt == 'cas':
-                cov_dict, covLib.reads_total, covLib.reads_mapped, read_cov_dict = BtIO.parseCas(covLib.f, self.order_of_blobs)
+                cov_dict, covLib.reads_total, covLib.reads_mapped, read_cov_dict = parsed_covLibs[covLib.name]
                 if covLib.reads_total == 0:
                     print BtLog.warn_d['4'] % covLib.f
                 for name, cov in cov_dict.items():
@@ -374,6 +531,7 @@ class BlobDb():
                 self.view(viewObjs=[covView], ranks=None, taxrule=None, hits_flag=None, seqs=None, cov_libs=[covLib.name], progressbar=False)
 
             elif covLib.fmt == 'cov':
+                print BtLog.status_d['1'] % (covLib.name, covLib.f)
                 base_cov_dict, covLib.reads_total, covLib.reads_mapped, covLib.reads_unmapped, read_cov_dict = BtIO.parseCov(covLib.f, set(self.dict_of_blobs))
                 #cov_dict = BtIO.readCov(covLib.f, set(self.dict_of_blobs))
                 if not len(base_cov_dict) == self.seqs:
@@ -391,6 +549,28 @@ class BlobDb():
             self.covLibs[covLib.name] = covLib
 
 
+    def mergeCov(self, cov_lib_name, cov_f):
+        '''
+        Replaces the coverage of the sequences in COV file cov_f (e.g. a
+        subset written by "blobtools map2cov --list") in cov lib cov_lib_name
+        of a BlobDB read by load(). Depth statistics and confidence intervals
+        of these sequences are dropped as they no longer apply
+        '''
+        if not cov_lib_name in self.covLibs:
+            BtLog.error('50', cov_lib_name, self.title)
+        base_cov_dict, reads_total, reads_mapped, reads_unmapped, read_cov_dict = BtIO.parseCov(cov_f, set(self.dict_of_blobs))
+        print BtLog.status_d['27'] % (len(base_cov_dict), cov_f, cov_lib_name)
+        covLib = self.covLibs[cov_lib_name]
+        for name, cov in base_cov_dict.items():
+            blob = self.dict_of_blobs[name]
+            covLib['cov_sum'] += cov - blob['covs'][cov_lib_name]
+            blob['covs'][cov_lib_name] = cov
+            if name in read_cov_dict:
+                blob['read_cov'][cov_lib_name] = read_cov_dict[name]
+            blob.get('cov_stats', {}).pop(cov_lib_name, None)
+            covLib.get('cov_ci', {}).pop(name, None)
+        covLib['mean_cov'] = covLib['cov_sum'] / self.seqs
+
     def parseHits(self, hitLibs):
         for hitLib in hitLibs:
             self.hitLibs[hitLib.name] = hitLib
@@ -403,19 +583,47 @@ class BlobDb():
                 self.set_of_taxIds.add(hitDict['taxId'])
                 self.dict_of_blobs[hitDict['name']].addHits(hitLib.name, hitDict)
 
-    def computeTaxonomy(self, taxrules, nodesDB, min_bitscore_diff, tax_collision_random):
+    def computeTaxonomy(self, taxrules, nodesDB, min_bitscore_diff, tax_collision_random, threads=1):
+        '''
+        Computes taxonomy of each blob under each of taxrules. If threads > 1,
+        blobs with hits are split into consecutive chunks that are computed
+        by a pool of 'threads' processes (which inherit the lineages when
+        forked) and merged back in the order of the chunks
+        '''
         print BtLog.status_d['6'] % ",".join(taxrules)
-        tree_lists = BtTax.getTreeList(self.set_of_taxIds, nodesDB)
-        self.lineages = BtTax.getLineages(tree_lists, nodesDB)
+        if isinstance(nodesDB, BtNodes.NodesDB): # lineages are projected in binary nodesDB
+            self.lineages = nodesDB.getLineages(self.set_of_taxIds)
+        else:
+            self.lineages = BtTax.resolveLineages(self.set_of_taxIds, nodesDB)
         self.taxrules = taxrules
+        # all taxrules are computed from one aggregation of hits (see BtTax.taxRules)
+        hit_blobs = [blObj for blObj in self.dict_of_blobs.values() if blObj.hits]
+        if threads > 1 and len(hit_blobs) > 1:
+            from multiprocessing import Pool
+            # several chunks per process, so that processes finishing early take over
+            chunk_size = -(-len(hit_blobs) // (threads * 4))
+            starts = range(0, len(hit_blobs), chunk_size)
+            chunks = ((taxrules, [blObj.hits for blObj in hit_blobs[start:start + chunk_size]], min_bitscore_diff, tax_collision_random) for start in starts)
+            BtTax.LINEAGES = self.lineages
+            pool = Pool(threads)
+            try:
+                for chunk_idx, taxonomies in enumerate(pool.imap(BtTax.taxRulesChunk, chunks)):
+                    for blObj, taxonomy in zip(hit_blobs[starts[chunk_idx]:starts[chunk_idx] + chunk_size], taxonomies):
+                        blObj.taxonomy.update(taxonomy)
+            finally:
+                pool.close()
+                pool.join()
+                BtTax.LINEAGES = None
+        else:
+            taxonomies = BtTax.taxRules(taxrules, [blObj.hits for blObj in hit_blobs], self.lineages, min_bitscore_diff, tax_collision_random)
+            for blObj, taxonomy in zip(hit_blobs, taxonomies):
+                blObj.taxonomy.update(taxonomy)
         i = 0
         for blObj in self.dict_of_blobs.values():
             i += 1
             BtLog.progress(i, 100, self.seqs)
-            for taxrule in taxrules:
-                if (blObj.hits):
-                    blObj.taxonomy[taxrule] = BtTax.taxRule(taxrule, blObj.hits, self.lineages, min_bitscore_diff, tax_collision_random)
-                else:
+            if not (blObj.hits):
+                for taxrule in taxrules:
                     blObj.taxonomy[taxrule] = BtTax.noHit()
         self.set_of_taxIds = set()
 
@@ -423,20 +631,58 @@ class BlobDb():
         for blObj in [self.dict_of_blobs[key] for key in self.order_of_blobs]:
             yield blObj
 
+def getCovOutFile(covLib, subset=False, prefix=None):
+    '''
+    Returns name (without '.cov') of the COV file of covLib (CovLibObj or
+    its dict in a loaded BlobDB) written by BlobDb.parseCoverage or
+    "blobtools view --cov". Libraries sharing a file are told apart by
+    their filter profile and depth sample ('<FILE>[.<PROFILE>][.<SAMPLE>]'),
+    COV files of a subset of sequences are marked as '<FILE>...subset', so
+    that they never replace a complete one
+    '''
+    covLib = getattr(covLib, '__dict__', covLib)
+    if covLib['f'] == '-':
+        return BtIO.getOutFile('%s.stdin' % (covLib['name']), prefix, None)
+    suffix = ".".join([part for part in [covLib.get('profile', None), covLib.get('sample', None), 'subset' if subset else None] if part])
+    return BtIO.getOutFile(covLib['f'], prefix, suffix)
+
+def parseCovLib(args):
+    '''
+    Parses a BAM/SAM/PAF/FASTQ/CAS file, may be run by a worker process of BlobDb.parseCovLibs
+    (returns None if parsing ended in an error, so that the pool does not hang)
+    '''
+    fmt, f, blobs, no_base_cov, threads, blob_lengths, window_size, sample_fraction, profiles, targeted, assembly_f = args
+    try:
+        if fmt == 'bam':
+            return BtIO.parseBam(f, blobs, no_base_cov, threads, blob_lengths, window_size, sample_fraction, profiles, targeted)
+        elif fmt == 'sam':
+            return BtIO.parseSam(f, blobs, no_base_cov, threads, blob_lengths, window_size, sample_fraction, profiles)
+        elif fmt == 'paf':
+            return BtIO.parsePaf(f, blobs, no_base_cov, blob_lengths, window_size, sample_fraction)
+        elif fmt == 'fastq':
+            return BtIO.parseFastq(f, blobs, assembly_f, threads, sample_fraction)
+        elif fmt == 'cas':
+            return BtIO.parseCas(f, blobs)
+    except SystemExit:
+        return None
+
 class BlObj():
-    def __init__(self, name, seq):
+    def __init__(self, name, stats):
+        '''
+        stats : [length, N count, G+C count, soft-masked count] of the sequence (see BtIO.getSeqStats)
+        '''
         self.name = name
-        self.length = len(seq)
-        self.n_count = seq.count('N')
+        self.length, self.n_count, gc_count, self.masked_count = stats
         self.agct_count = self.length - self.n_count
-        self.gc = round(self.calculateGC(seq), 4)
+        self.gc = round(self.calculateGC(gc_count), 4)
         self.covs = {}
         self.read_cov = {}
+        self.cov_stats = {}
         self.hits = {}
         self.taxonomy = {}
 
-    def calculateGC(self, seq):
-        return float((seq.count('G') + seq.count('C') ) / self.agct_count \
+    def calculateGC(self, gc_count):
+        return float(gc_count / self.agct_count \
                      if self.agct_count > 0 else 0.0)
 
     def addCov(self, lib_name, cov):
@@ -445,6 +691,9 @@ class BlObj():
     def addReadCov(self, lib_name, read_cov):
         self.read_cov[lib_name] = read_cov
 
+    def addCovStats(self, lib_name, cov_stats):
+        self.cov_stats[lib_name] = cov_stats # median, mad, breadth, cv of per-base depth
+
     def addHits(self, hitLibName, hitDict):
         if not hitLibName in self.hits:
             self.hits[hitLibName] = []
@@ -454,12 +703,16 @@ class CovLibObj():
     def __init__(self, name, fmt, f):
         self.name = name
         self.fmt = fmt
-        self.f = abspath(f) if isfile(f) else f # pass file/string/''
+        self.f = abspath(f) if exists(f) else f # pass file/named pipe/'-'/''
         self.cov_sum = 0.0
         self.reads_total = 0
         self.reads_mapped = 0
         self.reads_unmapped = 0
         self.mean_cov = 0.0
+        self.sample_fraction = None # fraction of reads coverage was estimated from
+        self.cov_ci = {} # confidence interval of coverage of each sequence, if sampled
+        self.profile = None # filter profile of alignments (see BtCov.parseProfile)
+        self.sample = None # sample of a multi-sample depth file (see BlobDb.parseDepth)
 
 class HitLibObj():
     def __init__(self, name, fmt, f):
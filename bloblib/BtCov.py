@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File        : BtCov.py
+Author      : Dominik R. Laetsch, dominik.laetsch at gmail dot com
+
+Components for computing coverage from alignments and statistics in
+windows along sequences. Run
+'python -m bloblib.BtCov' from the blobtools directory for a benchmark.
+"""
+
+from __future__ import division
+import re
+import struct
+import zlib
+from array import array
+import bloblib.BtLog as BtLog
+
+# CONSTs
+CIGAR_OPS = 'MIDNSHP=X'
+CIGAR_MATCH_OPS = frozenset(['M', '=', 'X']) # consume query and reference
+CIGAR_MATCH_CODES = frozenset([CIGAR_OPS.index(op) for op in CIGAR_MATCH_OPS])
+CIGAR_REF_OPS = frozenset(['M', 'D', 'N', '=', 'X']) # consume reference
+CIGAR_REF_CODES = frozenset([CIGAR_OPS.index(op) for op in CIGAR_REF_OPS])
+CIGAR_CACHE_SIZE = 10000
+SAMPLE_HASH_RANGE = 2 ** 32 # reads are sampled by crc32 of read name
+CI_Z = 1.96 # 95% confidence interval
+DEPTH_BLOCK_LINES = 100000 # lines of per-base depth converted at once
+# criteria of filter profiles : (min. MAPQ, required flags, excluded flags)
+PROFILE_CRITERIA = {'pp' : (0, 2, 0), 'fwd' : (0, 0, 16), 'rev' : (0, 16, 0)}
+
+class GenerationCache():
+    '''
+    Bounded cache of decode(key). Holds at most 2 * size keys: when the
+    current generation is full it replaces the previous one, so keys
+    that were not used during the last size misses are evicted.
+    Lookups of the current generation are done by the caller on
+    cache.current, misses go through lookup().
+    '''
+    def __init__(self, decode, size):
+        self.decode = decode
+        self.size = size
+        self.current = {}
+        self.previous = {}
+
+    def lookup(self, key):
+        value = self.previous.get(key)
+        if value is None:
+            value = self.decode(key)
+        if len(self.current) >= self.size:
+            self.previous = self.current
+            self.current = {}
+        self.current[key] = value
+        return value
+
+class CigarDecoder():
+    '''
+    Decodes CIGARs (text of SAM or packed uint32s of BAM) and caches the
+    results, since most reads of a library share a few thousand CIGARs.
+    '''
+    def __init__(self, cache_size=CIGAR_CACHE_SIZE):
+        self.cigar_re = re.compile(r"(\d+)([MIDNSHP=X])")
+        self.text_cache = GenerationCache(self.decodeAlignedBases, cache_size)
+        self.packed_cache = GenerationCache(self.decodeAlignedBasesPacked, cache_size)
+        self.string_cache = GenerationCache(self.decodeCigarString, cache_size)
+        self.span_cache = GenerationCache(self.decodeReferenceSpan, cache_size)
+        self.packed_span_cache = GenerationCache(self.decodeReferenceSpanPacked, cache_size)
+
+    def alignedBases(self, cigar):
+        '''
+        Returns number of bases aligned as M, = or X in a SAM CIGAR
+        '''
+        value = self.text_cache.current.get(cigar)
+        if value is None:
+            value = self.text_cache.lookup(cigar)
+        return value
+
+    def alignedBasesPacked(self, cigar):
+        '''
+        Returns number of bases aligned as M, = or X in a BAM CIGAR
+        '''
+        value = self.packed_cache.current.get(cigar)
+        if value is None:
+            value = self.packed_cache.lookup(cigar)
+        return value
+
+    def referenceSpan(self, cigar):
+        '''
+        Returns number of reference bases spanned by a SAM CIGAR
+        '''
+        value = self.span_cache.current.get(cigar)
+        if value is None:
+            value = self.span_cache.lookup(cigar)
+        return value
+
+    def referenceSpanPacked(self, cigar):
+        '''
+        Returns number of reference bases spanned by a BAM CIGAR
+        '''
+        value = self.packed_span_cache.current.get(cigar)
+        if value is None:
+            value = self.packed_span_cache.lookup(cigar)
+        return value
+
+    def cigarString(self, cigar):
+        '''
+        Returns SAM CIGAR of a BAM CIGAR
+        '''
+        value = self.string_cache.current.get(cigar)
+        if value is None:
+            value = self.string_cache.lookup(cigar)
+        return value
+
+    def decodeAlignedBases(self, cigar):
+        return sum([int(length) for length, op in self.cigar_re.findall(cigar) if op in CIGAR_MATCH_OPS])
+
+    def decodeAlignedBasesPacked(self, cigar):
+        ops = struct.unpack('<%dI' % (len(cigar) // 4), cigar)
+        return sum([op >> 4 for op in ops if (op & 15) in CIGAR_MATCH_CODES])
+
+    def decodeReferenceSpan(self, cigar):
+        return sum([int(length) for length, op in self.cigar_re.findall(cigar) if op in CIGAR_REF_OPS])
+
+    def decodeReferenceSpanPacked(self, cigar):
+        ops = struct.unpack('<%dI' % (len(cigar) // 4), cigar)
+        return sum([op >> 4 for op in ops if (op & 15) in CIGAR_REF_CODES])
+
+    def decodeCigarString(self, cigar):
+        ops = struct.unpack('<%dI' % (len(cigar) // 4), cigar)
+        return "".join(["%s%s" % (op >> 4, CIGAR_OPS[op & 15]) for op in ops]) if ops else '*'
+
+class CovAccumulator():
+    '''
+    Running sums of base and read coverage of contigs, held in arrays
+    indexed by contig, so that memory does not grow with the number of
+    reads. Doubles are used since C longs are 32 bit on some platforms.
+    If reads were sampled with sample_fraction (see isSampled), sums are
+    scaled by 1/sample_fraction and the sum of squared base coverage of
+    reads is kept for the confidence interval of base coverage.
+    '''
+    def __init__(self, names, sample_fraction=None):
+        self.names = list(names)
+        self.index = {name : idx for idx, name in enumerate(self.names)}
+        self.base_covs = array('d', [0.0]) * len(self.names)
+        self.read_covs = array('d', [0.0]) * len(self.names)
+        self.sample_fraction = sample_fraction
+        self.base_sq_covs = array('d', [0.0]) * len(self.names) if (sample_fraction) else None
+
+    def addRead(self, idx, base_cov):
+        self.base_covs[idx] += base_cov
+        self.read_covs[idx] += 1
+        if (self.sample_fraction):
+            self.base_sq_covs[idx] += base_cov * base_cov
+
+    def getIndices(self, names):
+        '''
+        Returns list of contig indices of names (e.g. the references of a
+        BAM header), None for names that are not accumulated
+        '''
+        return [self.index.get(name) for name in names]
+
+    def add(self, cov_accumulator):
+        '''
+        Adds the sums of cov_accumulator (of the same contigs)
+        '''
+        for idx, (base_cov, read_cov) in enumerate(zip(cov_accumulator.base_covs, cov_accumulator.read_covs)):
+            self.base_covs[idx] += base_cov
+            self.read_covs[idx] += read_cov
+        if (self.sample_fraction):
+            for idx, base_sq_cov in enumerate(cov_accumulator.base_sq_covs):
+                self.base_sq_covs[idx] += base_sq_cov
+
+    def getBaseCovDict(self):
+        scale = 1 / self.sample_fraction if (self.sample_fraction) else 1
+        return {name : int(round(base_cov * scale)) for name, base_cov in zip(self.names, self.base_covs)}
+
+    def getReadCovDict(self):
+        scale = 1 / self.sample_fraction if (self.sample_fraction) else 1
+        return {name : int(round(read_cov * scale)) for name, read_cov in zip(self.names, self.read_covs)}
+
+    def getBaseCovCIDict(self):
+        '''
+        Returns dict of name : [lower, upper] bound of the confidence interval
+        of base coverage, based on the variance of the Horvitz-Thompson
+        estimator under Bernoulli sampling, ((1 - f) / f^2) * sum(bases^2)
+        (alignments are treated as independent, although both reads of a
+        pair are sampled together). Empty if reads were not sampled
+        '''
+        if not (self.sample_fraction):
+            return {}
+        f = self.sample_fraction
+        ci_dict = {}
+        for name, base_cov, base_sq_cov in zip(self.names, self.base_covs, self.base_sq_covs):
+            half_width = CI_Z * (((1 - f) / (f * f)) * base_sq_cov) ** 0.5
+            ci_dict[name] = [max(0.0, base_cov / f - half_width), base_cov / f + half_width]
+        return ci_dict
+
+def parseProfile(profile):
+    '''
+    Returns (min_mapq, required_flags, excluded_flags) of a filter profile,
+    i.e. '+'-separated criteria 'q<INT>' (MAPQ >= INT), 'pp' (proper pair),
+    'fwd' or 'rev' (strand), e.g. 'q30+pp'
+    '''
+    min_mapq, required_flags, excluded_flags = 0, 0, 0
+    for criterion in profile.split('+'):
+        if criterion in PROFILE_CRITERIA:
+            criterion_mapq, criterion_required, criterion_excluded = PROFILE_CRITERIA[criterion]
+        elif criterion.startswith('q') and criterion[1:].isdigit():
+            criterion_mapq, criterion_required, criterion_excluded = int(criterion[1:]), 0, 0
+        else:
+            BtLog.error('48', profile)
+        min_mapq = max(min_mapq, criterion_mapq)
+        required_flags |= criterion_required
+        excluded_flags |= criterion_excluded
+    if required_flags & excluded_flags:
+        BtLog.error('48', profile)
+    return min_mapq, required_flags, excluded_flags
+
+def getProfileAccumulators(profiles, names, sample_fraction):
+    '''
+    Returns list of (min_mapq, required_flags, excluded_flags, CovAccumulator) of profiles
+    '''
+    return [parseProfile(profile) + (CovAccumulator(names, sample_fraction),) for profile in profiles]
+
+def getProfileCovDict(profiles, profile_accumulators):
+    '''
+    Returns dict of profile : (base_cov_dict, read_cov_dict, base_cov_ci_dict)
+    '''
+    profile_cov_dict = {}
+    for profile, (min_mapq, required_flags, excluded_flags, cov_accumulator) in zip(profiles, profile_accumulators):
+        profile_cov_dict[profile] = (cov_accumulator.getBaseCovDict(), cov_accumulator.getReadCovDict(), cov_accumulator.getBaseCovCIDict())
+    return profile_cov_dict
+
+def getSampleThreshold(sample_fraction):
+    return int(sample_fraction * SAMPLE_HASH_RANGE)
+
+def isSampled(read_name, sample_threshold):
+    '''
+    Deterministic sampling of reads by read name, so that both reads of a
+    pair and all alignments of a read are sampled together
+    '''
+    return (zlib.crc32(read_name) & 0xffffffff) < sample_threshold
+
+class DepthAccumulator():
+    '''
+    Collects reference start and end of the alignments of each contig.
+    Statistics of per-base depth are computed for one contig at a time
+    (see getDepthStats), either once all its alignments have been added
+    (coordinate-sorted input) or when getStatsDict is called.
+    '''
+    def __init__(self, names, lengths, window_size=None):
+        self.names = list(names)
+        self.lengths = list(lengths)
+        self.window_size = window_size
+        self.events = {} # contig index : (starts, ends)
+        self.stats = {} # contig index : dict of depth statistics
+
+    def add(self, idx, start, end):
+        try:
+            starts, ends = self.events[idx]
+        except KeyError:
+            starts, ends = self.events[idx] = (array('l'), array('l'))
+        starts.append(start)
+        ends.append(end)
+
+    def addEvents(self, depth_accumulator):
+        '''
+        Adds the alignments and the statistics of contigs already finalised
+        of depth_accumulator (of the same contigs)
+        '''
+        self.stats.update(depth_accumulator.stats)
+        for idx, (starts, ends) in depth_accumulator.events.items():
+            if not idx in self.events:
+                self.events[idx] = (array('l'), array('l'))
+            self.events[idx][0].extend(starts)
+            self.events[idx][1].extend(ends)
+
+    def finalise(self, idx):
+        starts, ends = self.events.pop(idx, (array('l'), array('l')))
+        self.stats[idx] = getDepthStats(self.lengths[idx], starts, ends, self.window_size)
+
+    def getStatsDict(self):
+        for idx in xrange(len(self.names)):
+            if not idx in self.stats:
+                self.finalise(idx)
+        return {self.names[idx] : stats for idx, stats in self.stats.items()}
+
+def getWindowStarts(length, window_size):
+    return range(0, length, window_size)
+
+def getDepthStats(length, starts, ends, window_size=None):
+    '''
+    Returns median, median absolute deviation, breadth (fraction of bases
+    covered) and coefficient of variation of the per-base depth of a contig,
+    computed from the starts and ends of its alignments (0-based, half-open)
+    by a difference array sweep, and the mean depth in windows of window_size
+    bases along the contig (if window_size)
+    '''
+    import numpy
+    if not length:
+        stats = {'median' : 0.0, 'mad' : 0.0, 'breadth' : 0.0, 'cv' : 0.0}
+        if (window_size):
+            stats['windows'] = []
+        return stats
+    starts = numpy.clip(numpy.frombuffer(starts, dtype=numpy.int_) if len(starts) else numpy.zeros(0, dtype=numpy.int_), 0, length)
+    ends = numpy.clip(numpy.frombuffer(ends, dtype=numpy.int_) if len(ends) else numpy.zeros(0, dtype=numpy.int_), 0, length)
+    depth = numpy.cumsum(numpy.bincount(starts, minlength=length + 1) - numpy.bincount(ends, minlength=length + 1))[:length]
+    median = float(numpy.median(depth))
+    mean = float(depth.mean())
+    stats = {
+        'median' : round(median, 4),
+        'mad' : round(float(numpy.median(numpy.abs(depth - median))), 4),
+        'breadth' : round(numpy.count_nonzero(depth) / length, 4),
+        'cv' : round(float(depth.std()) / mean, 4) if mean > 0 else 0.0
+        }
+    if (window_size):
+        window_starts = getWindowStarts(length, window_size)
+        window_lengths = numpy.diff(window_starts + [length])
+        window_depths = numpy.add.reduceat(depth, window_starts) / window_lengths
+        stats['windows'] = [float("{0:.3f}".format(window_depth)) for window_depth in window_depths]
+    return stats
+
+def getSeqWindowStats(seq, window_size):
+    '''
+    Returns lists of GC and N count in windows of window_size bases along seq,
+    GC being computed as in BtCore.BlObj (G and C of non-N bases)
+    '''
+    import numpy
+    if not seq:
+        return [], []
+    window_starts = getWindowStarts(len(seq), window_size)
+    window_lengths = numpy.diff(window_starts + [len(seq)])
+    bases = numpy.frombuffer(seq, dtype=numpy.uint8)
+    gc_counts = numpy.add.reduceat(((bases == ord('G')) | (bases == ord('C'))).astype(numpy.int_), window_starts)
+    n_counts = numpy.add.reduceat((bases == ord('N')).astype(numpy.int_), window_starts)
+    agct_counts = window_lengths - n_counts
+    gcs = [round(gc_count / agct_count, 4) if agct_count > 0 else 0.0 for gc_count, agct_count in zip(gc_counts.tolist(), agct_counts.tolist())]
+    return gcs, n_counts.tolist()
+
+def sumDepthBlock(block):
+    '''
+    Returns numpy array of the summed depth of each sample in block, a
+    list of the tab-separated depth columns of lines of 'samtools depth'
+    '''
+    import numpy
+    depths = numpy.fromstring(''.join(block), dtype=numpy.float64, sep=' ')
+    return depths.reshape(len(block), -1).sum(axis=0)
+
+def benchmarkCigar(reads=1000000):
+    '''
+    Reads per second of base coverage from SAM CIGARs, using the former
+    regex (which only matched M) and CigarDecoder
+    '''
+    import random
+    import time
+    random.seed(0)
+    cigars = ['150M'] * 80 + ['%sS%sM' % (i, 150 - i) for i in xrange(1, 11)] + \
+        ['%sM%sS' % (150 - i, i) for i in xrange(1, 11)] + ['%sM1I%sM' % (i, 149 - i) for i in xrange(1, 50)]
+    reads_cigars = [random.choice(cigars) for i in xrange(reads)]
+    cigar_match_re = re.compile(r"(\d+)M|X|=")
+    start = time.time()
+    before = [sum([int(matching) for matching in cigar_match_re.findall(cigar)]) for cigar in reads_cigars]
+    before_time = time.time() - start
+    cigar_decoder = CigarDecoder()
+    start = time.time()
+    after = [cigar_decoder.alignedBases(cigar) for cigar in reads_cigars]
+    after_time = time.time() - start
+    print "[INFO]\t: CIGARs : %s reads, %s distinct" % ('{:,}'.format(reads), len(cigars))
+    print "[INFO]\t: regex : %s reads/s" % ('{:,.0f}'.format(reads / before_time))
+    print "[INFO]\t: CigarDecoder : %s reads/s" % ('{:,.0f}'.format(reads / after_time))
+    print "[INFO]\t: Same aligned bases : %s" % (before == after)
+
+def maxRss(func, args, queue):
+    import resource
+    func(*args)
+    queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def sumLists(reads, contigs):
+    base_cov_dict = {contig : [] for contig in xrange(contigs)}
+    for i in xrange(reads):
+        base_cov_dict[i % contigs].append(150)
+    return {contig : sum(base_covs) for contig, base_covs in base_cov_dict.items()}
+
+def sumAccumulator(reads, contigs):
+    cov_accumulator = CovAccumulator(xrange(contigs))
+    base_covs = cov_accumulator.base_covs
+    for i in xrange(reads):
+        base_covs[i % contigs] += 150
+    return cov_accumulator.getBaseCovDict()
+
+def benchmarkAccumulator(read_counts=(1000000, 2000000, 4000000), contigs=10000):
+    '''
+    Peak RSS (kB, of a fresh process each) of summing base coverage of
+    reads in per-contig lists and in a CovAccumulator
+    '''
+    from multiprocessing import Process, Queue
+    for reads in read_counts:
+        peak_rss = []
+        for func in [sumLists, sumAccumulator]:
+            queue = Queue()
+            process = Process(target=maxRss, args=(func, (reads, contigs), queue))
+            process.start()
+            peak_rss.append(queue.get())
+            process.join()
+        print "[INFO]\t: %s reads : lists %s kB, CovAccumulator %s kB" % ('{:,}'.format(reads), '{:,}'.format(peak_rss[0]), '{:,}'.format(peak_rss[1]))
+
+if __name__ == "__main__":
+    benchmarkCigar()
+    benchmarkAccumulator()
@@ -11,13 +11,28 @@ import re
 import subprocess
 import os
 import zlib
+import bz2
+from cStringIO import StringIO
+from itertools import izip
 from collections import defaultdict
-from os.path import basename, isfile, splitext, join, isdir
+from array import array
+from os.path import basename, isfile, splitext, join, isdir, exists
+from sys import stdin
+from string import ascii_lowercase
 import shutil
 import bloblib.BtLog as BtLog
+import bloblib.BtBam as BtBam
+import bloblib.BtCov as BtCov
+import bloblib.BtKmer as BtKmer
+import bloblib.BtNodes as BtNodes
 
 # CONSTs
 COMPLEMENT = {'A':'T','C':'G','G':'C','T':'A','N':'N'}
+FASTA_CHUNK_SIZE = 2 ** 23 # bytes read at once by readFastaStats
+GZIP_MAGIC = '\x1f\x8b'
+BZ2_MAGIC = 'BZh'
+READ_BUFFER_SIZE = 2 ** 22 # bytes read at once by openFile
+BGZF_THREADS = 4 # threads inflating BGZF blocks in openFile
 
 def create_dir(directory="", overwrite=True):
     if directory:
@@ -31,10 +46,133 @@ def create_dir(directory="", overwrite=True):
     else:
         return None
 
+def getCompression(header):
+    '''
+    Returns 'bgzf', 'gzip', 'bz2' or None based on the first (16) bytes of a file
+    '''
+    if header.startswith(BtBam.BGZF_MAGIC) and header[12:14] == 'BC':
+        return 'bgzf'
+    elif header.startswith(GZIP_MAGIC):
+        return 'gzip'
+    elif header.startswith(BZ2_MAGIC):
+        return 'bz2'
+    return None
+
+def getFileCompression(infile):
+    with open(infile, 'rb') as fh:
+        return getCompression(fh.read(16))
+
+def readChunks(fh, data=''):
+    if (data):
+        yield data
+    for chunk in iter(lambda: fh.read(READ_BUFFER_SIZE), ''):
+        yield chunk
+
+def inflateStream(fh, compression, data=''):
+    '''
+    Yields the decompressed data of the gzip or bz2 stream fh, concatenated
+    members (e.g. of bgzip'ed files) are decompressed in turn. data is the
+    part of the stream already read from fh
+    '''
+    decompressor = None
+    while True:
+        if not data:
+            data = fh.read(READ_BUFFER_SIZE)
+            if not data:
+                break
+        if decompressor is None:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if compression == 'gzip' else bz2.BZ2Decompressor()
+        try:
+            inflated = decompressor.decompress(data)
+        except EOFError: # end of bz2 member, data is left for the next member
+            decompressor = None
+            continue
+        if (inflated):
+            yield inflated
+        data = decompressor.unused_data
+        if (data): # end of gzip member
+            decompressor = None
+
+class ChunkReader():
+    '''
+    Read-only file object over the chunks of data yielded by chunks,
+    supports iteration by line, read() and close()
+    '''
+    def __init__(self, chunks, close=None):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.closeFunc = close
+
+    def __iter__(self):
+        tail = self.buffer
+        self.buffer = ''
+        for chunk in self.chunks:
+            text = tail + chunk
+            end = text.rfind('\n') + 1
+            tail = text[end:]
+            if (end):
+                for line in StringIO(text[:end]):
+                    yield line
+        if (tail):
+            yield tail
+
+    def read(self, size=-1):
+        parts, length = [self.buffer], len(self.buffer)
+        while size < 0 or length < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            length += len(chunk)
+        data = ''.join(parts)
+        if size < 0:
+            self.buffer = ''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+    def close(self):
+        if self.closeFunc is not None:
+            self.closeFunc()
+            self.closeFunc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def openFile(infile, threads=BGZF_THREADS):
+    '''
+    Opens infile ('-' for STDIN) for reading. gzip, BGZF (bgzip) and bz2
+    compressed input is detected by its magic bytes (not by the extension)
+    and decompressed transparently, BGZF blocks of files on disk are
+    inflated by a pool of 'threads' threads
+    '''
+    if infile == '-' or not isfile(infile): # STDIN or named pipe, can't seek
+        fh = stdin if infile == '-' else open(infile, 'rb', READ_BUFFER_SIZE)
+        close = None if fh is stdin else fh.close
+        header = fh.read(16)
+        compression = getCompression(header)
+        if compression is None:
+            return ChunkReader(readChunks(fh, header), close)
+        return ChunkReader(inflateStream(fh, 'bz2' if compression == 'bz2' else 'gzip', header), close)
+    fh = open(infile, 'rb', READ_BUFFER_SIZE)
+    header = fh.read(16)
+    compression = getCompression(header)
+    if compression is None:
+        fh.seek(0)
+        return fh
+    elif compression == 'bgzf':
+        fh.close()
+        reader = BtBam.BgzfReader(infile, threads)
+        return ChunkReader((data for coffset, data in reader.blocks()), reader.close)
+    return ChunkReader(inflateStream(fh, compression, header), fh.close)
+
 def parseList(infile):
     if not isfile(infile):
         BtLog.error('0', infile)
-    with open(infile) as fh:
+    with openFile(infile) as fh:
         items = []
         for l in fh:
             items.append(l.rstrip("\n"))
@@ -45,7 +183,7 @@ def parseReferenceCov(infile):
     if infile:
         if not isfile(infile):
             BtLog.error('0', infile)
-        with open(infile) as fh:
+        with openFile(infile) as fh:
             for l in fh:
                 try:
                     cov_lib, reads_total_ref, reads_mapped_ref = l.split(",")
@@ -85,7 +223,7 @@ def parseCatColour(infile):
     if infile:
         if not isfile(infile):
             BtLog.error('0', infile)
-        with open(infile) as fh:
+        with openFile(infile) as fh:
             for l in fh:
                 try:
                     seq_name, category = l.rstrip("\n").split(",")
@@ -99,7 +237,7 @@ def parseDict(infile, key, value):
     if infile:
         if not isfile(infile):
             BtLog.error('0', infile)
-        with open(infile) as fh:
+        with openFile(infile) as fh:
             items = {}
             k_idx = int(key)
             v_idx = int(value)
@@ -113,7 +251,7 @@ def parseColours(infile):
     if infile:
         if not isfile(infile):
             BtLog.error('0', infile)
-        with open(infile) as fh:
+        with openFile(infile) as fh:
             for l in fh:
                 temp = l.rstrip("\n").split(",")
                 items[temp[0]] = temp[1]
@@ -122,7 +260,7 @@ def parseColours(infile):
 def parseSet(infile):
     if not isfile(infile):
         BtLog.error('0', infile)
-    with open(infile) as fh:
+    with openFile(infile) as fh:
         items = set()
         for l in fh:
             items.add(l.rstrip("\n").lstrip(">"))
@@ -130,24 +268,135 @@ def parseSet(infile):
 
 def parseFastaNameOrder(infile):
     fasta_order = []
-    for name, seq in readFasta(infile):
+    for name, stats in readFastaStats(infile):
         fasta_order.append(name)
     return fasta_order
 
 def readFasta(infile):
     if not isfile(infile):
         BtLog.error('0', infile)
-    with open(infile) as fh:
+    with openFile(infile) as fh:
         header, seqs = '', []
         for l in fh:
             if l[0] == '>':
                 if header:
                     yield header, ''.join(seqs)
-                header, seqs = l[1:-1].split()[0], [] # Header is split at first whitespace
+                header, seqs = l[1:].split()[0], [] # Header is split at first whitespace
             else:
-                seqs.append(l[:-1])
+                seqs.append(l.rstrip("\n")) # last line may lack a line break
         yield header, ''.join(seqs)
 
+def getSeqStats(seq):
+    '''
+    Returns [length, N count, G+C count, soft-masked (lower case) count] of
+    seq, which may contain line breaks. As in BtCore.BlObj, only upper case
+    N, G and C are counted
+    '''
+    line_breaks = seq.count('\n')
+    return [len(seq) - line_breaks, seq.count('N'), seq.count('G') + seq.count('C'), len(seq) - len(seq.translate(None, ascii_lowercase))]
+
+def seekFastaRecord(fh, start):
+    '''
+    Moves fh to the first header line starting at or after byte start and
+    returns its offset (size of the file if there is none)
+    '''
+    fh.seek(max(start - 1, 0))
+    if start == 0:
+        return 0
+    offset = start - 1 # offset of text[0]
+    text = fh.read(FASTA_CHUNK_SIZE)
+    while len(text) > 1:
+        idx = text.find('\n>')
+        if not idx == -1:
+            fh.seek(offset + idx + 1)
+            return offset + idx + 1
+        offset += len(text) - 1
+        text = text[-1:] + fh.read(FASTA_CHUNK_SIZE)
+    fh.seek(0, 2)
+    return fh.tell()
+
+def readFastaStats(infile, chunk_size=FASTA_CHUNK_SIZE, start=0, end=None):
+    '''
+    Yields name and stats (see getSeqStats) of each sequence, without
+    holding more than chunk_size bytes of a sequence in memory (chunks are
+    counted as a whole, not line by line)
+    If end is given, only the sequences whose header line starts within
+    the byte range [start, end) of the (uncompressed) file are parsed
+    '''
+    if not isfile(infile):
+        BtLog.error('0', infile)
+    name, stats = None, None
+    tail = '' # incomplete header line at the end of a chunk
+    with (openFile(infile) if end is None else open(infile, 'rb')) as fh:
+        offset = 0 if end is None else seekFastaRecord(fh, start) # offset of text[0]
+        while True:
+            chunk = fh.read(chunk_size)
+            text = tail + chunk
+            tail = ''
+            if (chunk):
+                line_start = text.rfind('\n') + 1
+                if text.startswith('>', line_start):
+                    text, tail = text[:line_start], text[line_start:]
+            pos = 0
+            while pos < len(text):
+                if text[pos] == '>':
+                    if end is not None and offset + pos >= end:
+                        chunk = None
+                        break
+                    if name is not None:
+                        yield name, stats
+                    eol = text.find('\n', pos)
+                    eol = len(text) if eol == -1 else eol
+                    name, stats = text[pos + 1:eol].split()[0], [0, 0, 0, 0] # Header is split at first whitespace
+                    pos = eol + 1
+                else:
+                    end_of_seq = text.find('\n>', pos)
+                    end_of_seq = len(text) if end_of_seq == -1 else end_of_seq + 1
+                    if name is not None:
+                        stats = [count + seq_count for count, seq_count in zip(stats, getSeqStats(text[pos:end_of_seq]))]
+                    pos = end_of_seq
+            if not (chunk):
+                break
+            offset += len(text)
+    if name is not None:
+        yield name, stats
+
+def parseFastaRange(args):
+    '''
+    Worker of readFastaStatsParallel, returns names and arrays of the stats
+    (see getSeqStats) of the sequences whose header starts within [start, end)
+    '''
+    infile, start, end = args
+    names, stats = [], [array('l') for i in xrange(4)]
+    for name, seq_stats in readFastaStats(infile, start=start, end=end):
+        names.append(name)
+        for values, value in zip(stats, seq_stats):
+            values.append(value)
+    return names, stats
+
+def readFastaStatsParallel(infile, threads=1):
+    '''
+    Yields name and stats of each sequence in the order of the file, as
+    readFastaStats. Uncompressed files on disk are split into 'threads'
+    byte ranges (aligned to header lines) which are parsed by separate
+    processes
+    '''
+    if threads < 2 or not isfile(infile) or getFileCompression(infile) is not None:
+        for name, stats in readFastaStats(infile):
+            yield name, stats
+        return
+    from multiprocessing import Pool
+    size = os.path.getsize(infile)
+    offsets = [size * i // threads for i in xrange(threads + 1)]
+    pool = Pool(threads)
+    try:
+        for names, stats in pool.imap(parseFastaRange, [(infile, offsets[i], offsets[i + 1]) for i in xrange(threads)]):
+            for record in izip(names, *stats):
+                yield record[0], list(record[1:])
+    finally:
+        pool.close()
+        pool.join()
+
 def runCmd(**kwargs):
     command = kwargs['command']
     cmd = command.split() # sanitation
@@ -179,72 +428,342 @@ def which(program):
                 return exe_file
     return None
 
-def checkBam(infile):
-    print BtLog.status_d['10']
-    if not isfile(infile):
-        BtLog.error('0', infile)
-    if not which('samtools'):
-        BtLog.error('7')
-    reads_mapped_re = re.compile(r"(\d+)\s\+\s\d+\smapped")
-    reads_secondary_re = re.compile(r"(\d+)\s\+\s\d+\ssecondary")
-    reads_supplementary_re = re.compile(r"(\d+)\s\+\s\d+\ssupplementary")
-    reads_total_re = re.compile(r"(\d+)\s\+\s\d+\sin total")
-    reads_total, reads_mapped = 0, 0
-    output = ''
-    command = "samtools flagstat " + infile
-    for line in runCmd(command=command):
-        output += line
-    reads_mapped = int(reads_mapped_re.search(output).group(1))
-    reads_secondary = int(reads_secondary_re.search(output).group(1))
-    reads_supplementary = int(reads_supplementary_re.search(output).group(1))
-    reads_mapped = reads_mapped - reads_secondary - reads_secondary
-    reads_total = int(reads_total_re.search(output).group(1)) - reads_secondary - reads_supplementary
+def getBamReadCounts(infile, flag_counts):
+    '''
+    reads_total and reads_mapped, excluding secondary and supplementary alignments
+    '''
+    flag_stats = BtBam.getFlagStats(flag_counts)
+    reads_total = flag_stats['total'] - flag_stats['secondary'] - flag_stats['supplementary']
+    reads_mapped = flag_stats['mapped'] - flag_stats['secondary'] - flag_stats['supplementary']
+    return checkBamReadCounts(infile, reads_total, reads_mapped)
+
+def checkBamReadCounts(infile, reads_total, reads_mapped):
     # check whether there are reads in BAM
     if not reads_total or not reads_mapped:
-        BtLog.error('29' % infile)
+        BtLog.error('29', infile)
     print BtLog.status_d['11'] % ('{:,}'.format(reads_mapped), \
         '{:,}'.format(reads_total), '{0:.1%}'.format(reads_mapped/reads_total))
     return reads_total, reads_mapped
 
-def parseSam(infile, set_of_blobs, no_base_cov_flag):
-    if not isfile(infile):
-        BtLog.error('0', infile)
-    base_cov_dict = {blob : [] for blob in set_of_blobs}
-    read_cov_dict = {blob : 0 for blob in set_of_blobs}
-    cigar_match_re = re.compile(r"(\d+)M|X|=") # only gets digits before M,X,='s
+def readLines(fh, start, end):
+    '''
+    Yields the lines of fh that start within the byte range [start, end)
+    '''
+    if start > 0:
+        fh.seek(start - 1)
+        start += len(fh.readline()) - 1 # end of line spanning start
+    pos = start
+    while pos < end:
+        line = fh.readline()
+        if not line:
+            break
+        pos += len(line)
+        yield line
+
+def isSamCoordinateSorted(infile):
+    '''
+    True if the header of SAM file infile has '@HD ... SO:coordinate'
+    '''
+    with openFile(infile) as fh:
+        for line in fh:
+            if not line.startswith("@"):
+                break
+            if line.startswith("@HD"):
+                return "SO:coordinate" in line.rstrip("\n").split("\t")
+    return False
+
+def parseSamRange(args):
+    '''
+    Parses the lines starting within a byte range of a SAM file (end is None
+    for the whole file/stream), may be run by a worker process of parseSam.
+    If the whole file/stream is parsed and its header marks it as
+    coordinate-sorted, depth statistics of a sequence are computed once
+    all its alignments are parsed (as in parseBam).
+    Returns CovAccumulator, DepthAccumulator (None if lengths is None),
+    reads_total, reads_mapped, dict of reads mapped to each sequence
+    which is not part of the assembly and the profile accumulators (see
+    BtCov.getProfileAccumulators)
+    '''
+    infile, start, end, names, no_base_cov_flag, lengths, window_size, sample_fraction, profiles = args
+    cov_accumulator = BtCov.CovAccumulator(names, sample_fraction)
+    profile_accumulators = BtCov.getProfileAccumulators(profiles, names, sample_fraction)
+    sample_threshold = BtCov.getSampleThreshold(sample_fraction) if (sample_fraction) else None
+    base_sq_covs = cov_accumulator.base_sq_covs
+    depth_accumulator = BtCov.DepthAccumulator(names, lengths, window_size) if lengths is not None else None
+    blob_idxs = cov_accumulator.index
+    base_covs = cov_accumulator.base_covs
+    read_covs = cov_accumulator.read_covs
+    cigar_decoder = BtCov.CigarDecoder()
+    unknown_counts = defaultdict(int)
     reads_total = 0
     reads_mapped = 0
-    if not (no_base_cov_flag):
-        with open(infile) as fh:
-            for line in fh:
-                if line.startswith("@"):
-                    pass
-                else:
-                    reads_total += 1
-                    match = line.split()
-                    if not match[2] == '*':
+    is_sorted = False
+    last_blob_idx = None
+    fh = openFile(infile) if end is None else open(infile)
+    try:
+        for line in (fh if end is None else readLines(fh, start, end)):
+            if line.startswith("@"):
+                if end is None and line.startswith("@HD"):
+                    is_sorted = "SO:coordinate" in line.rstrip("\n").split("\t")
+            else:
+                reads_total += 1
+                if sample_threshold is not None and not BtCov.isSampled(line[:line.find('\t')], sample_threshold):
+                    if not line.split(None, 3)[2] == '*':
                         reads_mapped += 1
-                        try:
-                            base_cov_dict[match[2]].append(sum([int(matching) for matching in cigar_match_re.findall(match[5])]))
-                            read_cov_dict[match[2]] += 1
-                        except:
-                            print BtLog.warn_d['2'] % (match[2])
+                    continue
+                match = line.split()
+                if not match[2] == '*':
+                    reads_mapped += 1
+                    blob_idx = blob_idxs.get(match[2])
+                    if blob_idx is None:
+                        unknown_counts[match[2]] += 1
+                    else:
+                        base_cov = 0
+                        if not (no_base_cov_flag):
+                            base_cov = cigar_decoder.alignedBases(match[5])
+                            base_covs[blob_idx] += base_cov
+                            if base_sq_covs is not None:
+                                base_sq_covs[blob_idx] += base_cov * base_cov
+                        read_covs[blob_idx] += 1
+                        if (profile_accumulators):
+                            flag, mapq = int(match[1]), int(match[4])
+                            for min_mapq, required_flags, excluded_flags, profile_accumulator in profile_accumulators:
+                                if mapq >= min_mapq and flag & required_flags == required_flags and not flag & excluded_flags:
+                                    profile_accumulator.addRead(blob_idx, base_cov)
+                        if depth_accumulator is not None:
+                            if is_sorted and not blob_idx == last_blob_idx:
+                                if last_blob_idx is not None:
+                                    depth_accumulator.finalise(last_blob_idx)
+                                last_blob_idx = blob_idx
+                            ref_start = int(match[3]) - 1
+                            depth_accumulator.add(blob_idx, ref_start, ref_start + cigar_decoder.referenceSpan(match[5]))
+    finally:
+        fh.close()
+    return cov_accumulator, depth_accumulator, reads_total, reads_mapped, dict(unknown_counts), profile_accumulators
+
+def parseSam(infile, set_of_blobs, no_base_cov_flag, threads=1, blob_lengths=None, window_size=None, sample_fraction=None, profiles=None):
+    '''
+    infile may be '-' (STDIN) or a named pipe, so that the output of an
+    aligner can be parsed without writing it to disk
+    uncompressed SAM files on disk are split into 'threads' byte ranges
+    (aligned to lines) which are parsed by separate processes, unless depth
+    statistics are computed from a coordinate-sorted file, which is parsed
+    in one pass so that the alignments of only one sequence are held
+    sequences which are not part of the assembly are reported once
+    depth statistics of each sequence (incl. mean depth in windows of
+    window_size) are computed if blob_lengths (dict of sequence lengths) is
+    given, otherwise cov_stats_dict is empty
+    base and read coverage are estimated from the reads sampled with
+    sample_fraction (see BtCov.isSampled), base_cov_ci_dict holds the
+    confidence intervals of base coverage (empty if not sampled)
+    coverage of alignments passing each filter profile (see
+    BtCov.parseProfile) is summed in the same pass, profile_cov_dict holds
+    profile : (base_cov_dict, read_cov_dict, base_cov_ci_dict)
+    '''
+    profiles = profiles or []
+    if not infile == '-' and not exists(infile):
+        BtLog.error('0', infile)
+    names = list(set_of_blobs)
+    lengths = [blob_lengths[name] for name in names] if blob_lengths is not None else None
+    if threads > 1 and isfile(infile) and getFileCompression(infile) is None and not (lengths is not None and isSamCoordinateSorted(infile)):
+        from multiprocessing import Pool
+        size = os.path.getsize(infile)
+        offsets = [size * i // threads for i in xrange(threads + 1)]
+        pool = Pool(threads)
+        results = pool.map(parseSamRange, [(infile, offsets[i], offsets[i + 1], names, no_base_cov_flag, lengths, window_size, sample_fraction, profiles) for i in xrange(threads)])
+        pool.close()
+        pool.join()
     else:
-        with open(infile) as fh:
-            for line in fh:
-                if line.startswith("@"):
-                    pass
-                else:
-                    reads_total += 1
-                    match = line.split()
-                    if not match[2] == '*':
-                        reads_mapped += 1
-                        try:
-                            read_cov_dict[match[2]] += 1
-                        except:
-                            print BtLog.warn_d['2'] % (match[2])
-    base_cov_dict = {seq_name: sum(base_covs) for seq_name, base_covs in base_cov_dict.items()}
-    return base_cov_dict, reads_total, reads_mapped, read_cov_dict
+        results = [parseSamRange((infile, 0, None, names, no_base_cov_flag, lengths, window_size, sample_fraction, profiles))]
+    cov_accumulator = BtCov.CovAccumulator(names, sample_fraction)
+    profile_accumulators = BtCov.getProfileAccumulators(profiles, names, sample_fraction)
+    depth_accumulator = BtCov.DepthAccumulator(names, lengths, window_size) if lengths is not None else None
+    reads_total, reads_mapped = 0, 0
+    unknown_counts = {}
+    for range_cov_accumulator, range_depth_accumulator, range_reads_total, range_reads_mapped, range_unknown_counts, range_profile_accumulators in results:
+        cov_accumulator.add(range_cov_accumulator)
+        for profile_accumulator, range_profile_accumulator in zip(profile_accumulators, range_profile_accumulators):
+            profile_accumulator[3].add(range_profile_accumulator[3])
+        if depth_accumulator is not None:
+            depth_accumulator.addEvents(range_depth_accumulator)
+        reads_total += range_reads_total
+        reads_mapped += range_reads_mapped
+        for name, count in range_unknown_counts.items():
+            unknown_counts[name] = unknown_counts.get(name, 0) + count
+    for name in sorted(unknown_counts):
+        print BtLog.warn_d['2'] % (name)
+    cov_stats_dict = depth_accumulator.getStatsDict() if depth_accumulator is not None else {}
+    profile_cov_dict = BtCov.getProfileCovDict(profiles, profile_accumulators)
+    return cov_accumulator.getBaseCovDict(), reads_total, reads_mapped, cov_accumulator.getReadCovDict(), cov_stats_dict, cov_accumulator.getBaseCovCIDict(), profile_cov_dict
+
+def parsePaf(infile, set_of_blobs, no_base_cov_flag, blob_lengths=None, window_size=None, sample_fraction=None):
+    '''
+    Parses PAF (e.g. minimap2 long-read mappings), infile may be compressed
+    (see openFile), '-' (STDIN) or a named pipe
+    base coverage is the number of matching bases (column 10) and depth
+    statistics are based on target start and end, as in parseSam
+    only primary alignments ('tp:A:P' or no 'tp' tag) are counted, PAF
+    lists no unmapped reads, so reads_total is reads_mapped
+    Returns the same tuple as parseSam (profile_cov_dict is empty)
+    '''
+    if not infile == '-' and not exists(infile):
+        BtLog.error('0', infile)
+    names = list(set_of_blobs)
+    cov_accumulator = BtCov.CovAccumulator(names, sample_fraction)
+    sample_threshold = BtCov.getSampleThreshold(sample_fraction) if (sample_fraction) else None
+    depth_accumulator = None
+    if blob_lengths is not None:
+        depth_accumulator = BtCov.DepthAccumulator(names, [blob_lengths[name] for name in names], window_size)
+    blob_idxs = cov_accumulator.index
+    unknown_counts = defaultdict(int)
+    reads_mapped = 0
+    fh = openFile(infile)
+    try:
+        for line in fh:
+            match = line.rstrip("\n").split("\t")
+            if len(match) < 12:
+                continue
+            if 'tp:A:' in line and not 'tp:A:P' in match[12:]:
+                continue
+            reads_mapped += 1
+            if sample_threshold is not None and not BtCov.isSampled(match[0], sample_threshold):
+                continue
+            blob_idx = blob_idxs.get(match[5])
+            if blob_idx is None:
+                unknown_counts[match[5]] += 1
+                continue
+            cov_accumulator.addRead(blob_idx, 0 if (no_base_cov_flag) else int(match[9]))
+            if depth_accumulator is not None:
+                depth_accumulator.add(blob_idx, int(match[7]), int(match[8]))
+    finally:
+        fh.close()
+    for name in sorted(unknown_counts):
+        print BtLog.warn_d['2'] % (name)
+    reads_total, reads_mapped = checkBamReadCounts(infile, reads_mapped, reads_mapped)
+    cov_stats_dict = depth_accumulator.getStatsDict() if depth_accumulator is not None else {}
+    return cov_accumulator.getBaseCovDict(), reads_total, reads_mapped, cov_accumulator.getReadCovDict(), cov_stats_dict, cov_accumulator.getBaseCovCIDict(), {}
+
+def readFastqChunks(infile, chunk_size):
+    '''
+    Yields lists of (name, sequence) of chunk_size reads of a FASTQ file,
+    infile may be compressed (see openFile), '-' (STDIN) or a named pipe
+    '''
+    fh = openFile(infile)
+    try:
+        chunk = []
+        for idx, line in enumerate(fh):
+            if idx % 4 == 0:
+                name = line[1:].split(None, 1)[0] if line.strip() else ''
+            elif idx % 4 == 1:
+                chunk.append((name, line.rstrip()))
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+        if (chunk):
+            yield chunk
+    finally:
+        fh.close()
+
+def parseFastq(infile, set_of_blobs, assembly_f, threads=1, sample_fraction=None):
+    '''
+    Alignment-free coverage from the reads of a FASTQ file: minimizers of the
+    sequences of the assembly (assembly_f) are indexed by BtKmer.KmerIndex
+    and each read is assigned to the sequence hit by most of its minimizers
+    base coverage of a sequence is the summed length of its reads
+    chunks of reads are assigned by a pool of 'threads' processes, which
+    share the index of this process
+    with sample_fraction, only sampled reads are assigned and reads_mapped is estimated
+    Returns the same tuple as parseSam (without depth statistics and profiles)
+    '''
+    from collections import deque
+    if not infile == '-' and not exists(infile):
+        BtLog.error('0', infile)
+    names = list(set_of_blobs)
+    cov_accumulator = BtCov.CovAccumulator(names, sample_fraction)
+    sample_threshold = BtCov.getSampleThreshold(sample_fraction) if (sample_fraction) else None
+    blob_idxs = cov_accumulator.index
+    BtKmer.INDEX = BtKmer.KmerIndex((blob_idxs[name], seq) for name, seq in readFasta(assembly_f) if name in blob_idxs)
+    reads_total, reads_assigned = 0, 0
+    pool = None
+    if threads > 1:
+        from multiprocessing import Pool
+        pool = Pool(threads)
+    # at most 2 chunks per process are read ahead
+    pending = deque()
+    chunks = readFastqChunks(infile, BtKmer.CHUNK_READS)
+    while True:
+        chunk = next(chunks, None)
+        if chunk is not None:
+            reads_total += len(chunk)
+            if sample_threshold is not None:
+                chunk = [read for read in chunk if BtCov.isSampled(read[0], sample_threshold)]
+            reads = [seq for name, seq in chunk]
+            if pool is None:
+                pending.append((reads, BtKmer.assignReads(reads)))
+            else:
+                pending.append((reads, pool.apply_async(BtKmer.assignReads, (reads,))))
+        if (pending) and (chunk is None or len(pending) >= 2 * threads):
+            reads, assignments = pending.popleft()
+            if pool is not None:
+                assignments = assignments.get()
+            for seq, blob_idx in zip(reads, assignments.tolist()):
+                if blob_idx >= 0:
+                    cov_accumulator.addRead(blob_idx, len(seq))
+                    reads_assigned += 1
+        elif chunk is None:
+            break
+    if pool is not None:
+        pool.close()
+        pool.join()
+    BtKmer.INDEX = None
+    reads_mapped = min(int(round(reads_assigned / sample_fraction)), reads_total) if (sample_fraction) else reads_assigned
+    reads_total, reads_mapped = checkBamReadCounts(infile, reads_total, reads_mapped)
+    return cov_accumulator.getBaseCovDict(), reads_total, reads_mapped, cov_accumulator.getReadCovDict(), {}, cov_accumulator.getBaseCovCIDict(), {}
+
+def parseDepth(infile, order_of_blobs):
+    '''
+    Parses per-base depth of one or more samples from the output of
+    'samtools depth [-a] [-H] BAM...' (sequence, position, depth of each
+    sample) in a single pass, infile may be compressed (see openFile),
+    '-' (STDIN) or a named pipe
+    lines are converted to numbers in blocks of consecutive lines of a
+    sequence (see BtCov.sumDepthBlock)
+    Returns list of sample labels (None if there is no header) and numpy
+    matrix of summed depth (sequences of order_of_blobs x samples, None if
+    infile is empty)
+    '''
+    if not infile == '-' and not exists(infile):
+        BtLog.error('0', infile)
+    import numpy
+    blob_idxs = {name : idx for idx, name in enumerate(order_of_blobs)}
+    labels, depth_matrix = None, None
+    unknown_counts = defaultdict(int)
+    block, block_idx = [], None
+    fh = openFile(infile)
+    try:
+        for line in fh:
+            if line.startswith("#"):
+                labels = line.rstrip("\n").split("\t")[2:]
+                continue
+            name, pos, depths = line.split("\t", 2)
+            blob_idx = blob_idxs.get(name)
+            if blob_idx is None:
+                unknown_counts[name] += 1
+                continue
+            if not blob_idx == block_idx or len(block) == BtCov.DEPTH_BLOCK_LINES:
+                if (block):
+                    depth_matrix[block_idx] += BtCov.sumDepthBlock(block)
+                block, block_idx = [], blob_idx
+            if depth_matrix is None:
+                depth_matrix = numpy.zeros((len(order_of_blobs), depths.count("\t") + 1))
+            block.append(depths)
+        if (block):
+            depth_matrix[block_idx] += BtCov.sumDepthBlock(block)
+    finally:
+        fh.close()
+    for name in sorted(unknown_counts):
+        print BtLog.warn_d['2'] % (name)
+    return labels, depth_matrix
 
 def write_read_pair_seqs(used_fhs, read_pair_out_fs, read_pair_seqs):
     for read_type in read_pair_seqs:
@@ -294,24 +813,26 @@ def print_bam(read_pair_out_fs, read_pair_type, read1, read2):
 
 def parseBamForFilter(infile, outfile, include, exclude, gzip, do_sort, keep_sorted, sort_threads):
     '''
-    checkBam returns reads_total and reads_mapped
     parse BAM to extract readpairs
+    reads_total and reads_mapped are counted while parsing
     '''
     if not isfile(infile):
         BtLog.error('0', infile)
     if do_sort:
+        if not which('samtools'):
+            BtLog.error('7')
         command = 'samtools sort -@ sort_threads -n -O bam -T temp -o %s.readsorted.bam %s' % (infile, infile)
         runCmd(command=command, wait=True)
         infile = "%s.readsorted.bam" % infile
 
-    reads_total, reads_mapped = checkBam(infile)
-    progress_unit = int(reads_mapped/1000)
-    command = "samtools view -f 1 -F 1024 -F 256 -F 2048 %s" % infile
+    bam = BtBam.BamReader(infile, progress=True)
+    # only paired reads (no optical duplicates, no 2nd-ary/supplementary alignment)
+    flag_filter = 1024 | 256 | 2048
     seen_reads = 0
     read_pair_count, read_pair_seqs, read_pair_out_fs = init_read_pairs(outfile, include, exclude)
     read_pair_out_fhs = []
     used_fhs = {}
-    iterator = runCmd(command=command)
+    iterator = (read for read in bam.samAlignments() if int(read[1]) & 1 and not int(read[1]) & flag_filter)
     read_pair_type = None
     if include:
         sequence_to_type_dict = defaultdict(lambda: 'Ex')
@@ -326,21 +847,21 @@ def parseBamForFilter(infile, outfile, include, exclude, gzip, do_sort, keep_sor
     else:
         sequence_to_type_dict = defaultdict(lambda: 'In')
         sequence_to_type_dict['*'] = 'Un'
-    for l in iterator:
-        read1 = l.split()
+    for read1 in iterator:
         try:
             seen_reads += 2
-            read2 = next(iterator).split()
+            read2 = next(iterator)
             read_pair_type = "".join(sorted([sequence_to_type_dict[read1[2]], sequence_to_type_dict[read2[2]]]))
             print_bam(read_pair_out_fs, read_pair_type, read1, read2)
             read_pair_seqs[read_pair_type] += get_read_pair_seqs(read1, read2)
             read_pair_count[read_pair_type] += 1
-            BtLog.progress(seen_reads, progress_unit, reads_total)
-            if seen_reads % progress_unit == 0:
+            if seen_reads % 100000 == 0:
                 used_fhs = write_read_pair_seqs(used_fhs, read_pair_out_fs, read_pair_seqs)
                 read_pair_seqs = {read_pair_type : tuple() for read_pair_type in read_pair_count}
         except StopIteration:
                 print BtLog.warn_d['11']
+    bam.close()
+    reads_total, reads_mapped = getBamReadCounts(infile, bam.flag_counts)
     used_fhs = write_read_pair_seqs(used_fhs, read_pair_out_fs, read_pair_seqs)
     close_fhs(used_fhs)
     # info log
@@ -373,51 +894,233 @@ def get_table(table):
         table_string.append('| %s | %s | %s |' % (line[0].rjust(col_width[0]), line[1].rjust(col_width[1]), line[2].rjust(col_width[2])))
     return "\n".join(table_string) + "\n"
 
-def parseBam(infile, set_of_blobs, no_base_cov_flag):
+def getBalancedGroups(weights, count):
     '''
-    checkBam returns reads_total and reads_mapped
-    base_cov_dict is list of coverages for each contigs, since list appending should be faster
+    Splits the indices of weights into count groups of similar total weight
+    (largest first, each assigned to the group with smallest total)
+    '''
+    groups = [[] for i in xrange(count)]
+    totals = [0] * count
+    for idx in sorted(xrange(len(weights)), key=lambda i: weights[i], reverse=True):
+        group_idx = totals.index(min(totals))
+        groups[group_idx].append(idx)
+        totals[group_idx] += weights[idx]
+    return [group for group in groups if group]
 
+def parseBamRegions(args):
+    '''
+    Worker of parseBam, returns base coverage, sum of squared base coverage
+    of reads (if sampled), read coverage and depth statistics (if
+    cov_stats_flag) of each (ref_id, voffset) region as dict of
+    ref_id : [base_cov, base_sq_cov, read_cov, cov_stats, profile_covs] and
+    the counts of each flag, profile_covs holds [base_cov, base_sq_cov,
+    read_cov] of each filter profile
+    '''
+    infile, regions, no_base_cov_flag, cov_stats_flag, window_size, sample_fraction, profiles = args
+    bam = BtBam.BamReader(infile, sample_fraction=sample_fraction)
+    profile_filters = [BtCov.parseProfile(profile) for profile in profiles]
+    flag_filter = 1024 | 4 | 256
+    cov_dict = {}
+    for ref_id, voffset in regions:
+        base_cov, base_sq_cov, read_cov = 0, 0, 0
+        profile_covs = [[0, 0, 0] for profile in profiles]
+        starts, ends = array('l'), array('l')
+        for _ref_id, pos, mapq, flag, cigar in bam.fetch(ref_id, voffset):
+            if flag & flag_filter:
+                continue
+            read_base_cov = 0
+            if not (no_base_cov_flag):
+                read_base_cov = bam.cigar_decoder.alignedBasesPacked(cigar)
+                base_cov += read_base_cov
+                base_sq_cov += read_base_cov * read_base_cov
+            read_cov += 1
+            for (min_mapq, required_flags, excluded_flags), profile_cov in zip(profile_filters, profile_covs):
+                if mapq >= min_mapq and flag & required_flags == required_flags and not flag & excluded_flags:
+                    profile_cov[0] += read_base_cov
+                    profile_cov[1] += read_base_cov * read_base_cov
+                    profile_cov[2] += 1
+            if (cov_stats_flag):
+                starts.append(pos)
+                ends.append(pos + bam.cigar_decoder.referenceSpanPacked(cigar))
+        cov_stats = BtCov.getDepthStats(bam.references[ref_id][1], starts, ends, window_size) if (cov_stats_flag) else None
+        cov_dict[ref_id] = [base_cov, base_sq_cov, read_cov, cov_stats, profile_covs]
+    bam.close()
+    return cov_dict, bam.flag_counts
+
+def parseBamByRegion(infile, references, index, set_of_blobs, no_base_cov_flag, blob_lengths, window_size, sample_fraction, profiles, processes, targeted=False):
+    '''
+    References of a coordinate-sorted, indexed BAM are split into groups of
+    similar total length, which are parsed by separate processes
+    with targeted, only the alignments to set_of_blobs are fetched and counted
+    Returns CovAccumulator, profile accumulators, cov_stats_dict and counts of each flag
+    '''
+    from multiprocessing import Pool
+    cov_accumulator = BtCov.CovAccumulator(set_of_blobs, sample_fraction)
+    profile_accumulators = BtCov.getProfileAccumulators(profiles, set_of_blobs, sample_fraction)
+    cov_stats_flag = blob_lengths is not None
+    cov_stats_dict = {}
+    regions = [(ref_id, index.getStart(ref_id)) for ref_id in xrange(len(references))]
+    regions = [(ref_id, voffset) for ref_id, voffset in regions if voffset is not None]
+    if (targeted):
+        regions = [(ref_id, voffset) for ref_id, voffset in regions if references[ref_id][0] in set_of_blobs]
+    groups = getBalancedGroups([references[ref_id][1] for ref_id, voffset in regions], processes)
+    tasks = [(infile, [regions[i] for i in group], no_base_cov_flag, cov_stats_flag, window_size, sample_fraction, profiles) for group in groups]
+    # unmapped reads without coordinates are counted based on the index
+    flag_counts = [0] * BtBam.FLAG_COUNT
+    if not (targeted):
+        flag_counts[4] = index.n_no_coor
+    pool = None
+    if len(tasks) > 1:
+        pool = Pool(len(tasks))
+        results = pool.imap_unordered(parseBamRegions, tasks)
+    else:
+        results = map(parseBamRegions, tasks)
+    for idx, (cov_dict, group_flag_counts) in enumerate(results):
+        for ref_id, (base_cov, base_sq_cov, read_cov, cov_stats, profile_covs) in cov_dict.items():
+            name = references[ref_id][0]
+            blob_idx = cov_accumulator.index.get(name)
+            if blob_idx is None:
+                if (read_cov):
+                    print BtLog.warn_d['2'] % (name)
+            else:
+                cov_accumulator.base_covs[blob_idx] += base_cov
+                cov_accumulator.read_covs[blob_idx] += read_cov
+                if (sample_fraction):
+                    cov_accumulator.base_sq_covs[blob_idx] += base_sq_cov
+                for profile_accumulator, (profile_base_cov, profile_base_sq_cov, profile_read_cov) in zip(profile_accumulators, profile_covs):
+                    profile_cov_accumulator = profile_accumulator[3]
+                    profile_cov_accumulator.base_covs[blob_idx] += profile_base_cov
+                    profile_cov_accumulator.read_covs[blob_idx] += profile_read_cov
+                    if (sample_fraction):
+                        profile_cov_accumulator.base_sq_covs[blob_idx] += profile_base_sq_cov
+                if (cov_stats_flag):
+                    cov_stats_dict[name] = cov_stats
+        flag_counts = [count + group_count for count, group_count in zip(flag_counts, group_flag_counts)]
+        BtLog.progress(idx + 1, 1, len(groups))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if (cov_stats_flag):
+        # sequences without alignments in the BAM have a depth of zero
+        for name in set_of_blobs:
+            if not name in cov_stats_dict:
+                cov_stats_dict[name] = BtCov.getDepthStats(blob_lengths[name], [], [], window_size)
+    return cov_accumulator, profile_accumulators, cov_stats_dict, flag_counts
+
+def parseBamIndex(infile, references, index, set_of_blobs):
+    '''
+    Read coverage of each sequence, reads_total and reads_mapped based on the
+    number of mapped and unmapped alignments in the pseudo-bins of the BAM
+    index, without parsing alignments. Unlike parseBam, secondary,
+    supplementary and duplicate alignments are counted
     '''
+    print BtLog.status_d['26'] % (index.f)
+    base_cov_dict = {blob : 0 for blob in set_of_blobs}
+    read_cov_dict = {blob : 0 for blob in set_of_blobs}
+    reads_mapped, reads_unmapped = 0, index.n_no_coor
+    for (name, length), meta in zip(references, index.meta):
+        if meta is None:
+            continue
+        ref_beg, ref_end, n_mapped, n_unmapped = meta
+        reads_mapped += n_mapped
+        reads_unmapped += n_unmapped
+        if name in read_cov_dict:
+            read_cov_dict[name] = n_mapped
+        elif (n_mapped):
+            print BtLog.warn_d['2'] % (name)
+    reads_total, reads_mapped = checkBamReadCounts(infile, reads_mapped + reads_unmapped, reads_mapped)
+    return base_cov_dict, reads_total, reads_mapped, read_cov_dict, {}, {}, {}
+
+def hasIndexCounts(index):
+    '''
+    Pseudo-bins are written by samtools >= 0.1.19 for each reference with alignments
+    '''
+    return all([meta is not None or not chunks for meta, chunks in zip(index.meta, index.chunks)])
+
+def parseBam(infile, set_of_blobs, no_base_cov_flag, threads=1, blob_lengths=None, window_size=None, sample_fraction=None, profiles=None, targeted=False):
+    '''
+    base and read coverage are summed per contig by a BtCov.CovAccumulator
+    alignments are decoded by BtBam.BamReader, BGZF blocks are inflated using 'threads' threads
+    coordinate-sorted and indexed BAMs are parsed by region using 'threads' processes
+    with targeted (e.g. a subset of sequences), only the alignments to
+    set_of_blobs are fetched from a coordinate-sorted and indexed BAM, and
+    reads_total and reads_mapped are those of these alignments
+    reads_total and reads_mapped are counted while parsing
+    with no_base_cov_flag (and no depth statistics or profiles), reads of indexed BAMs are counted by parseBamIndex
+    depth statistics of each sequence (incl. mean depth in windows of
+    window_size) are computed if blob_lengths (dict of sequence lengths) is
+    given, otherwise cov_stats_dict is empty
+    base and read coverage are estimated from the reads sampled with
+    sample_fraction (see BtCov.isSampled), base_cov_ci_dict holds the
+    confidence intervals of base coverage (empty if not sampled)
+    coverage of alignments passing each filter profile (see
+    BtCov.parseProfile) is summed in the same pass, profile_cov_dict holds
+    profile : (base_cov_dict, read_cov_dict, base_cov_ci_dict)
+    '''
+    profiles = profiles or []
     if not isfile(infile):
         BtLog.error('0', infile)
-    reads_total, reads_mapped = checkBam(infile)
-    progress_unit = int(reads_mapped/1000)
-    base_cov_dict = {blob : [] for blob in set_of_blobs}
-    #base_cov_dict = {blob : 0 for blob in set_of_blobs}
-    read_cov_dict = {blob : 0 for blob in set_of_blobs}
-    cigar_match_re = re.compile(r"(\d+)M|X|=") # only gets digits before M,X,='s
-    # execute samtools to get only mapped reads (no optial duplicates, no 2nd-ary alignment)
-    command = "samtools view -F 1024 -F 4 -F 256 " + infile
-    seen_reads = 0
-    #import time
-    #start = time.time()
-    if not (no_base_cov_flag):
-        for line in runCmd(command=command):
-            seen_reads += 1
-            match = line.split()
-            try:
-                base_cov_dict[match[2]].append(sum([int(matching) for matching in cigar_match_re.findall(match[5])]))
-                #base_cov_dict[match[2]] += sum([int(matching) for matching in cigar_match_re.findall(match[5])])
-                read_cov_dict[match[2]] += 1
-            except:
-                print BtLog.warn_d['2'] % (match[2])
-            BtLog.progress(seen_reads, progress_unit, reads_mapped)
+    bam = BtBam.BamReader(infile, threads, progress=True, sample_fraction=sample_fraction)
+    index_f = BtBam.getIndexFile(infile)
+    if (targeted) and (not (index_f) or not bam.isCoordinateSorted()):
+        BtLog.error('49', infile)
+    if (no_base_cov_flag) and blob_lengths is None and not (profiles) and not (targeted) and (index_f):
+        # read coverage only, counted by the index if possible
+        index = BtBam.BamIndex(index_f)
+        if hasIndexCounts(index):
+            bam.close()
+            return parseBamIndex(infile, bam.references, index, set_of_blobs)
+    if (threads > 1 or targeted) and (index_f) and bam.isCoordinateSorted():
+        bam.close()
+        cov_accumulator, profile_accumulators, cov_stats_dict, flag_counts = parseBamByRegion(infile, bam.references, BtBam.BamIndex(index_f), set_of_blobs, no_base_cov_flag, blob_lengths, window_size, sample_fraction, profiles, threads, targeted)
     else:
-        for line in runCmd(command=command):
-            seen_reads += 1
-            match = line.split()
-            try:
-                read_cov_dict[match[2]] += 1
-            except:
-                print BtLog.warn_d['2'] % (match[2])
-            BtLog.progress(seen_reads, progress_unit, reads_mapped)
-    if not int(reads_mapped) == int(seen_reads):
-        print BtLog.warn_d['3'] % (reads_mapped, seen_reads)
-    base_cov_dict = {seq_name: sum(base_covs) for seq_name, base_covs in base_cov_dict.items()}
-    #end = time.time()
-    #print (end-start)
-    return base_cov_dict, reads_total, reads_mapped, read_cov_dict
+        cov_accumulator = BtCov.CovAccumulator(set_of_blobs, sample_fraction)
+        profile_accumulators = BtCov.getProfileAccumulators(profiles, cov_accumulator.names, sample_fraction)
+        base_covs = cov_accumulator.base_covs
+        base_sq_covs = cov_accumulator.base_sq_covs
+        read_covs = cov_accumulator.read_covs
+        depth_accumulator = None
+        if blob_lengths is not None:
+            depth_accumulator = BtCov.DepthAccumulator(cov_accumulator.names, [blob_lengths[name] for name in cov_accumulator.names], window_size)
+        # depth statistics of a sequence are computed once all its alignments are parsed
+        is_sorted = bam.isCoordinateSorted()
+        last_blob_idx = None
+        # refIDs of BAM header are resolved once, None if sequence is not in assembly
+        blob_idxs = cov_accumulator.getIndices([name for name, length in bam.references])
+        # only mapped reads (no optical duplicates, no 2nd-ary alignment)
+        flag_filter = 1024 | 4 | 256
+        unknown_ref_ids = set()
+        for ref_id, pos, mapq, flag, cigar in bam.alignments():
+            if flag & flag_filter or ref_id < 0:
+                continue
+            blob_idx = blob_idxs[ref_id]
+            if blob_idx is None:
+                unknown_ref_ids.add(ref_id)
+            else:
+                base_cov = 0
+                if not (no_base_cov_flag):
+                    base_cov = bam.cigar_decoder.alignedBasesPacked(cigar)
+                    base_covs[blob_idx] += base_cov
+                    if base_sq_covs is not None:
+                        base_sq_covs[blob_idx] += base_cov * base_cov
+                read_covs[blob_idx] += 1
+                for min_mapq, required_flags, excluded_flags, profile_accumulator in profile_accumulators:
+                    if mapq >= min_mapq and flag & required_flags == required_flags and not flag & excluded_flags:
+                        profile_accumulator.addRead(blob_idx, base_cov)
+                if depth_accumulator is not None:
+                    if is_sorted and not blob_idx == last_blob_idx:
+                        if last_blob_idx is not None:
+                            depth_accumulator.finalise(last_blob_idx)
+                        last_blob_idx = blob_idx
+                    depth_accumulator.add(blob_idx, pos, pos + bam.cigar_decoder.referenceSpanPacked(cigar))
+        bam.close()
+        for name in sorted([bam.references[ref_id][0] for ref_id in unknown_ref_ids]):
+            print BtLog.warn_d['2'] % (name)
+        flag_counts = bam.flag_counts
+        cov_stats_dict = depth_accumulator.getStatsDict() if depth_accumulator is not None else {}
+    reads_total, reads_mapped = getBamReadCounts(infile, flag_counts)
+    profile_cov_dict = BtCov.getProfileCovDict(profiles, profile_accumulators)
+    return cov_accumulator.getBaseCovDict(), reads_total, reads_mapped, cov_accumulator.getReadCovDict(), cov_stats_dict, cov_accumulator.getBaseCovCIDict(), profile_cov_dict
 
 def parseCovFromHeader(fasta_type, header):
     '''
@@ -460,7 +1163,7 @@ def parseCov(infile, set_of_blobs):
     seqs_parsed = 0
     progress_unit = 1
     old_format = 1
-    with open(infile) as fh:
+    with openFile(infile) as fh:
         for line in fh:
             if line.startswith("#"):
                 old_format = 0
@@ -554,7 +1257,7 @@ def readTax(infile, set_of_blobs):
     if not isfile(infile):
         BtLog.error('0', infile)
     hit_line_re = re.compile(r"^(\S+)\s+(\d+)[\;?\d+]*\s+(\d+\.*\d*)") # TEST TEST , if not split it afterwards
-    with open(infile) as fh:
+    with openFile(infile) as fh:
         for line in fh:
             match = hit_line_re.search(line)
             if match:
@@ -569,9 +1272,47 @@ def readTax(infile, set_of_blobs):
                     BtLog.error('22', infile)
                 yield hitDict
 
+def parseSampleFraction(sample_fraction):
+    '''
+    Returns sample fraction as float, None if all reads are used
+    '''
+    try:
+        fraction = float(sample_fraction)
+    except ValueError:
+        BtLog.error('46', sample_fraction)
+    if not 0.0 < fraction <= 1.0:
+        BtLog.error('46', sample_fraction)
+    return fraction if fraction < 1.0 else None
+
+def parseProfiles(profiles):
+    '''
+    Returns list of unique filter profiles, checked by BtCov.parseProfile
+    '''
+    unique_profiles = []
+    for profile in profiles:
+        BtCov.parseProfile(profile)
+        if not profile in unique_profiles:
+            unique_profiles.append(profile)
+    return unique_profiles
+
+def checkNumpy(options):
+    '''
+    Exits with an error before any file is parsed if numpy, which is
+    required by options (list of the options given), is not installed
+    '''
+    if (options):
+        import imp
+        try:
+            imp.find_module('numpy')
+        except ImportError:
+            BtLog.error('51', ", ".join(options))
+
 def getOutFile(base_file, prefix, suffix):
     EXTENSIONS = ['.fasta', '.fa', '.fna', '.txt', '.cov', '.out', '.json']
+    COMPRESSION_EXTENSIONS = ['.gz', '.bgz', '.bz2'] # see openFile
     out_f, extension = splitext(basename(base_file))
+    if extension in COMPRESSION_EXTENSIONS:
+        out_f, extension = splitext(out_f)
     if not extension in EXTENSIONS:
         out_f = '%s%s' % (out_f, extension)
     if (prefix):
@@ -583,12 +1324,42 @@ def getOutFile(base_file, prefix, suffix):
         out_f = "%s.%s" % (out_f, suffix)
     return out_f
 
+def getNodesDBBinFile(nodesDB_f):
+    return splitext(nodesDB_f)[0] + ".bin"
+
+def isCurrentNodesDBBin(nodesDB_bin_f, nodesDB_f=None):
+    '''
+    True if nodesDB_bin_f is a binary nodesDB which was written from the text
+    nodesDB_f (same path and size, see BtNodes.getNodesDBBinSource) and is
+    not older than it
+    '''
+    if not isfile(nodesDB_bin_f) or not BtNodes.isNodesDBBin(nodesDB_bin_f):
+        return False
+    if nodesDB_f is not None and isfile(nodesDB_f) and not BtNodes.isNodesDBBin(nodesDB_f):
+        if not BtNodes.getNodesDBBinSource(nodesDB_bin_f) == (os.path.abspath(nodesDB_f), os.path.getsize(nodesDB_f)):
+            return False
+        return os.path.getmtime(nodesDB_bin_f) >= os.path.getmtime(nodesDB_f)
+    return True
+
+def readNodesDBBin(nodesDB_bin_f, nodesDB_f=None):
+    '''
+    Returns memory-mapped binary nodesDB (BtNodes.NodesDB) if nodesDB_bin_f
+    is current (see isCurrentNodesDBBin), otherwise None
+    '''
+    if isCurrentNodesDBBin(nodesDB_bin_f, nodesDB_f):
+        return BtNodes.NodesDB(nodesDB_bin_f)
+    return None
+
 def parseNodesDB(**kwargs):
     '''
     Parsing names.dmp and nodes.dmp into the 'nodes_db' dict of dicts that
     gets JSON'ed into blobtools/data/nodes_db.json if this file
     does not exist. Nodes_db.json is used if neither "--names" and "--nodes"
     nor "--db" is specified.
+    A binary nodesDB (see BtNodes) is written next to the text nodesDB it
+    is parsed from (nodesDB.txt or "--db", as nodesDB.bin) and is
+    memory-mapped instead of parsing the text file, if it was written from
+    this file and is not older than it. "--db" may also be a binary nodesDB
     '''
     nodesDB = {}
     names_f = kwargs['names']
@@ -611,29 +1382,47 @@ def parseNodesDB(**kwargs):
             BtLog.error('0', nodesDB_f)
         print BtLog.status_d['4'] % (nodesDB_f)
         try:
-            nodesDB = readNodesDB(nodesDB_f)
+            nodesDB = readNodesDBBin(nodesDB_f) or readNodesDBBin(getNodesDBBinFile(nodesDB_f), nodesDB_f) or readNodesDB(nodesDB_f)
         except:
             BtLog.error('27', nodesDB_f)
     elif (nodesDB_default):
-        if not isfile(nodesDB_default):
+        nodesDB_bin_default = getNodesDBBinFile(nodesDB_default)
+        if not isfile(nodesDB_default) and not isfile(nodesDB_bin_default):
             BtLog.error('28')
-        print BtLog.status_d['4'] % (nodesDB_default)
         try:
-            nodesDB = readNodesDB(nodesDB_default)
+            nodesDB = readNodesDBBin(nodesDB_bin_default, nodesDB_default)
+            nodesDB_f = nodesDB_default if nodesDB is None else nodesDB_bin_default
+            print BtLog.status_d['4'] % (nodesDB_f)
+            if nodesDB is None:
+                nodesDB = readNodesDB(nodesDB_default)
         except:
-            BtLog.error('27', nodesDB_default)
-        nodesDB_f = nodesDB_default
+            BtLog.error('27', nodesDB_f)
 
     # Write nodesDB if not available
+    if isinstance(nodesDB, BtNodes.NodesDB):
+        return nodesDB, nodesDB_f
+    # text nodesDB that nodesDB was parsed from (names.dmp/nodes.dmp only become the default nodesDB if there is none)
+    source_f = nodesDB_f if (nodesDB_f) and not (nodes_f and names_f) else None
     if not isfile(nodesDB_default):
         writeNodesDB(nodesDB, nodesDB_default)
+        source_f = nodesDB_default
+    if source_f is not None:
+        nodesDB_bin_f = getNodesDBBinFile(source_f)
+        if not isCurrentNodesDBBin(nodesDB_bin_f, source_f):
+            print BtLog.status_d['24'] % nodesDB_bin_f
+            try:
+                BtNodes.writeNodesDBBin(nodesDB, nodesDB_bin_f, source_f)
+            except ValueError:
+                print BtLog.warn_d['12'] % nodesDB_bin_f
+            except (IOError, OSError):
+                print BtLog.warn_d['13'] % nodesDB_bin_f
 
     return nodesDB, nodesDB_f
 
 def readNamesNodes(names_f, nodes_f):
     nodesDB = {}
     nodes_count = 0
-    with open(nodes_f) as fh:
+    with openFile(nodes_f) as fh:
         for line in fh:
             nodes_col = line.split("\t")
             node = {}
@@ -642,7 +1431,7 @@ def readNamesNodes(names_f, nodes_f):
             node['rank'] = nodes_col[4]
             nodesDB[node_id] = node
             nodes_count += 1
-    with open(names_f) as fh:
+    with openFile(names_f) as fh:
         for line in fh:
             names_col = line.split("\t")
             if names_col[6] == "scientific name":
@@ -654,7 +1443,7 @@ def readNodesDB(nodesDB_f):
     nodesDB = {}
     nodesDB_count = 0
     nodes_count = 0
-    with open(nodesDB_f) as fh:
+    with openFile(nodesDB_f) as fh:
         for line in fh:
             if line.startswith("#"):
                 nodesDB_count = int(line.lstrip("# nodes_count = ").rstrip("\n"))
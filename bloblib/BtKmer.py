@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File        : BtKmer.py
+Author      : Dominik R. Laetsch, dominik.laetsch at gmail dot com
+
+Alignment-free coverage from reads: (w,k)-minimizers of the assembly are
+stored in a compact index (sorted numpy arrays of minimizer hash and
+sequence index), and each read is assigned to the sequence most of its
+minimizers hit. Minimizers of many sequences/reads are computed at once by
+numpy, canonical k-mers (k <= 32) being encoded as 2 bits per base.
+Requires numpy.
+"""
+
+from __future__ import division
+
+# CONSTs
+KMER_SIZE = 31
+WINDOW_SIZE = 10 # k-mers per minimizer window (<= KMER_SIZE)
+SEGMENT_LENGTH = 1000000 # sequences of the assembly are indexed in segments of this length
+CHUNK_READS = 20000 # reads assigned at once (by one process)
+INDEX = None # KmerIndex of worker processes, set before the pool is forked
+
+def getCodeTable():
+    import numpy
+    table = numpy.full(256, 4, dtype=numpy.uint8)
+    for code, bases in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+        for base in bases:
+            table[ord(base)] = code
+    return table
+
+def getHashes(kmers):
+    '''
+    Returns 64-bit mix (finaliser of MurmurHash3) of k-mers, so that the
+    minimum of a window is not biased towards poly-A k-mers
+    '''
+    import numpy
+    hashes = kmers ^ (kmers >> numpy.uint64(33))
+    hashes *= numpy.uint64(0xff51afd7ed558ccd)
+    hashes ^= hashes >> numpy.uint64(33)
+    hashes *= numpy.uint64(0xc4ceb9fe1a85ec53)
+    hashes ^= hashes >> numpy.uint64(33)
+    return hashes
+
+def getMinimizers(seqs, code_table, kmer_size=KMER_SIZE, window_size=WINDOW_SIZE):
+    '''
+    Returns numpy arrays of the hashes of the distinct minimizers of seqs
+    and the index of the sequence of each minimizer. k-mers containing
+    other bases than ACGT are skipped.
+    seqs are joined by a single 'N', so that no k-mer spans two sequences
+    and each window (of at most kmer_size k-mers) belongs to the sequence
+    containing its last k-mer
+    '''
+    import numpy
+    joined = 'N'.join(seqs) + 'N'
+    span = len(joined) - kmer_size + 1
+    window_count = span - window_size + 1
+    if window_count <= 0:
+        return numpy.zeros(0, dtype=numpy.uint64), numpy.zeros(0, dtype=numpy.int64)
+    codes = code_table[numpy.frombuffer(joined, dtype=numpy.uint8)]
+    invalid_counts = numpy.concatenate(([0], numpy.cumsum(codes > 3)))
+    valid = (invalid_counts[kmer_size:] - invalid_counts[:span]) == 0
+    codes = (codes & 3).astype(numpy.uint64)
+    forward = numpy.zeros(span, dtype=numpy.uint64)
+    reverse = numpy.zeros(span, dtype=numpy.uint64)
+    for offset in xrange(kmer_size):
+        forward <<= numpy.uint64(2)
+        forward |= codes[offset:offset + span]
+        reverse |= (numpy.uint64(3) - codes[offset:offset + span]) << numpy.uint64(2 * offset)
+    hashes = getHashes(numpy.minimum(forward, reverse))
+    max_hash = numpy.iinfo(numpy.uint64).max
+    hashes[~valid] = max_hash
+    minimizers = hashes[:window_count].copy()
+    for offset in xrange(1, window_size):
+        numpy.minimum(minimizers, hashes[offset:offset + window_count], out=minimizers)
+    # sequence of each base (separator belongs to the preceding sequence)
+    owners = numpy.repeat(numpy.arange(len(seqs)), [len(seq) + 1 for seq in seqs])
+    owners = owners[window_size - 1:window_size - 1 + window_count]
+    found = minimizers != max_hash
+    minimizers, owners = minimizers[found], owners[found]
+    # windows overlapping the same minimizer are consecutive
+    distinct = numpy.ones(len(minimizers), dtype=bool)
+    distinct[1:] = (minimizers[1:] != minimizers[:-1]) | (owners[1:] != owners[:-1])
+    return minimizers[distinct], owners[distinct]
+
+class KmerIndex():
+    '''
+    Minimizers of the sequences of the assembly, minimizers of more than one
+    sequence are dropped. keys (sorted hashes) and seq_idxs are numpy arrays
+    '''
+    def __init__(self, seqs):
+        '''
+        seqs : iterable of (seq_idx, sequence)
+        '''
+        import numpy
+        self.code_table = getCodeTable()
+        overlap = KMER_SIZE + WINDOW_SIZE - 2
+        key_arrays, idx_arrays = [], []
+        batch, batch_idxs, batch_length = [], [], 0
+        for seq_idx, seq in seqs:
+            for start in xrange(0, max(len(seq) - overlap, 1), SEGMENT_LENGTH):
+                segment = seq[start:start + SEGMENT_LENGTH + overlap]
+                batch.append(segment)
+                batch_idxs.append(seq_idx)
+                batch_length += len(segment)
+                if batch_length >= SEGMENT_LENGTH:
+                    self.addBatch(batch, batch_idxs, key_arrays, idx_arrays)
+                    batch, batch_idxs, batch_length = [], [], 0
+        self.addBatch(batch, batch_idxs, key_arrays, idx_arrays)
+        keys = numpy.concatenate(key_arrays) if (key_arrays) else numpy.zeros(0, dtype=numpy.uint64)
+        seq_idxs = numpy.concatenate(idx_arrays) if (idx_arrays) else numpy.zeros(0, dtype=numpy.int32)
+        order = numpy.lexsort((seq_idxs, keys))
+        keys, seq_idxs = keys[order], seq_idxs[order]
+        distinct = numpy.ones(len(keys), dtype=bool)
+        distinct[1:] = (keys[1:] != keys[:-1]) | (seq_idxs[1:] != seq_idxs[:-1])
+        keys, seq_idxs = keys[distinct], seq_idxs[distinct]
+        unique = numpy.ones(len(keys), dtype=bool)
+        shared = keys[1:] == keys[:-1]
+        unique[1:] &= ~shared
+        unique[:-1] &= ~shared
+        self.keys = keys[unique]
+        self.seq_idxs = seq_idxs[unique]
+        self.seq_count = int(seq_idxs.max()) + 1 if len(seq_idxs) else 0
+
+    def addBatch(self, batch, batch_idxs, key_arrays, idx_arrays):
+        import numpy
+        if (batch):
+            minimizers, owners = getMinimizers(batch, self.code_table)
+            key_arrays.append(minimizers)
+            idx_arrays.append(numpy.array(batch_idxs, dtype=numpy.int32)[owners])
+
+    def assignReads(self, reads):
+        '''
+        Returns numpy array of the index of the sequence hit by most
+        minimizers of each read (lowest index if tied, -1 if no hit)
+        '''
+        import numpy
+        assignments = numpy.full(len(reads), -1, dtype=numpy.int64)
+        if not len(self.keys):
+            return assignments
+        minimizers, owners = getMinimizers(reads, self.code_table)
+        positions = numpy.minimum(numpy.searchsorted(self.keys, minimizers), len(self.keys) - 1)
+        hit = self.keys[positions] == minimizers
+        pairs = owners[hit] * self.seq_count + self.seq_idxs[positions[hit]]
+        pairs, counts = numpy.unique(pairs, return_counts=True)
+        read_idxs, seq_idxs = pairs // self.seq_count, pairs % self.seq_count
+        order = numpy.lexsort((-counts, read_idxs))
+        read_idxs, seq_idxs = read_idxs[order], seq_idxs[order]
+        best = numpy.ones(len(read_idxs), dtype=bool)
+        best[1:] = read_idxs[1:] != read_idxs[:-1]
+        assignments[read_idxs[best]] = seq_idxs[best]
+        return assignments
+
+def assignReads(reads):
+    '''
+    Worker of BtIO.parseFastq, uses the KmerIndex INDEX inherited from the parent process
+    '''
+    return INDEX.assignReads(reads)
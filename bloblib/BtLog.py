@@ -64,7 +64,7 @@ error_d = {
     '28' : '[ERROR:28]\t: Please specify "--names" and "--nodes", or "--db"',
     '29' : '[ERROR:29]\t: No mapping reads found in %s',
     '30' : '[ERROR:30]\t: The module docopt is not installed. Please install it to run blobtools\n\tpip install docopt',
-    '31' : '[ERROR:31]\t: Please specify a read mapping file (BAM/SAM/CAS)',
+    '31' : '[ERROR:31]\t: Please specify a read mapping file (BAM/SAM/PAF/CAS) or reads (FASTQ)',
     '32' : '[ERROR:32]\t: Choose either --cumulative or --multiplot',
     '33' : '[ERROR:33] : CovLib(s) not found. The available covlibs are: \n%s',
     '34' : '[ERROR:34] : Invalid plot type : %s',
@@ -76,7 +76,15 @@ error_d = {
     '40' : '[ERROR:40] : CovLib \'%s\' not specified in refcov file',
     '41' : '[ERROR:41] : Please specify either a ID-to-taxID mapping file or a taxID.',
     '42' : '[ERROR:42] : SubjectID %s not found in ID-to-taxID mapping file %s.',
-    '43' : '[ERROR:43] : %s could not be found.'
+    '43' : '[ERROR:43] : %s could not be found.',
+    '44' : '[ERROR:44] : Only one coverage library can be read from STDIN (\'-\')',
+    '45' : '[ERROR:45] : BlobDB %s contains no windows (see "blobtools create --window")',
+    '46' : '[ERROR:46] : Sample fraction has to be > 0 and <= 1 : %s',
+    '47' : '[ERROR:47] : "--sample_fraction" can not be combined with "--cov_stats" or "--window"',
+    '48' : '[ERROR:48] : Invalid filter profile : %s (criteria \'q<INT>\', \'pp\', \'fwd\' or \'rev\', combined with \'+\')',
+    '49' : '[ERROR:49] : Coverage of a subset of sequences ("--list") can only be parsed from coordinate-sorted and indexed BAM files : %s',
+    '50' : '[ERROR:50] : Coverage library %s is not part of BlobDB %s',
+    '51' : '[ERROR:51] : The module numpy is not installed. Please install it to use %s\n\tpip install numpy'
 
 }
 
@@ -84,7 +92,7 @@ warn_d = {
     '0' : '[WARN]\t\t: No tax files specified.',
     '1' : '[WARN]\t\t: %s not in colour file %s ...',
     '2' : '[WARN]\t\t: %s is not part of the assembly',
-    '3' : '\n[WARN]\t\t: Based on samtools flagstat: expected %s reads, %s reads were parsed',
+    '3' : '\n[WARN]\t\t: Based on BAM flags: expected %s reads, %s reads were parsed',
     '4' : '[WARN]\t\t: No coverage data found in %s',
     '5' : '[WARN]\t\t: Hit for sequence %s in tax file %s has multiple taxIds, only first one is used.',
     '6' : '[WARN]\t\t: Sum of coverage in cov lib %s is 0.0. Please ignore this warning if "--no_base_cov" was specified.',
@@ -93,6 +101,8 @@ warn_d = {
     '9' : '[WARN]\t\t: Taxrule "%s" was not computed for this BlobDb. Available taxrule(s) : %s. Will proceed without taxonomic annotation ...',
     '10' : '[WARN]\t\t: Line %s: sequence "%s" already has TaxID "%s". Skipped. (use --force to overwrite)',
     '11' : '\n[WARN]\t\t: The BAM file appears to be truncated.',
+    '12' : '[WARN]\t\t: Binary nodesDB %s was not written (taxIds have to be integers).',
+    '13' : '[WARN]\t\t: Binary nodesDB %s could not be written.',
 
 }
 status_d = {
@@ -106,7 +116,6 @@ status_d = {
     '7' : '[STATUS]\t: Generating BlobDB and writing to file %s',
     '8' : '[STATUS]\t: Plotting %s',
     '9' : '[STATUS]\t: Reading BlobDB %s',
-    '10': '[STATUS]\t: \tChecking with \'samtools flagstat\'',
     '11': '[STATUS]\t: \tMapping reads = %s, total reads = %s (mapping rate = %s)',
     '12': '[STATUS]\t: \tChecking with \'clc_mapping_info\'',
     '13': '[STATUS]\t: \tWriting %s',
@@ -120,7 +129,9 @@ status_d = {
     '22': '[STATUS]\t: Filtering %s ...',
     '23': '[STATUS]\t: Extracted %s (list=%s, parsed=%s, total=%s) ...',
     '24': '[STATUS]\t: Writing %s',
-    '25': '[STATUS]\t: Gzip\'ing %s'
+    '25': '[STATUS]\t: Gzip\'ing %s',
+    '26': '[STATUS]\t: \tCounting reads based on BAM index %s (mapped reads include secondary, supplementary and duplicate alignments)',
+    '27': '[STATUS]\t: Merging coverage of %s sequence(s) from %s into %s'
 }
 
 info_d = {
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File        : BtNodes.py
+Author      : Dominik R. Laetsch, dominik.laetsch at gmail dot com
+
+Binary nodesDB. Nodes are stored in fixed-width columns (sorted taxIds,
+parent node indices, rank codes and indices into a table of interned
+names) behind a direct taxId -> node index lookup table. The file is
+memory-mapped, so that it is loaded instantly and its pages are shared
+between processes reading the same file.
+The lineage of each node (name index at each of BtTax.RANKS, incl. the
+"<higher rank>-undef" names of BtTax.getLineages) is projected once, when
+the file is written, so that lineages of taxIds are looked up by indexing.
+The path and size of the text nodesDB it was written from (if any) are
+stored, so that it is not used as the binary nodesDB of another file.
+"""
+
+from __future__ import division
+import mmap
+import os
+import struct
+from array import array
+import bloblib.BtTax as BtTax
+
+# CONSTs
+NODESDB_MAGIC = 'BTNODES\x03'
+# magic, nodes, max taxId, names, size of rank table, size of projected rank table, size of name table,
+# size of the source nodesDB file, length of its path
+NODESDB_HEADER = struct.Struct('<8sIIIIIIQI')
+UNDEF = -1 # rank without name in projections
+INT32 = struct.Struct('<i')
+UINT32 = struct.Struct('<I')
+
+def isNodesDBBin(infile):
+    with open(infile, 'rb') as fh:
+        return fh.read(len(NODESDB_MAGIC)) == NODESDB_MAGIC
+
+def getNodesDBBinSource(infile):
+    '''
+    Returns path and size of the text nodesDB that the binary nodesDB infile
+    was written from (None and 0 if it was not written from a file)
+    '''
+    with open(infile, 'rb') as fh:
+        header = fh.read(NODESDB_HEADER.size)
+        source_size, source_length = NODESDB_HEADER.unpack(header)[-2:]
+        fh.seek(-source_length, os.SEEK_END)
+        source_f = fh.read(source_length) if (source_length) else None
+    return source_f, source_size
+
+def getRawProjection(parents, rank_columns, name_idxs, root_idx, rank_count):
+    '''
+    Returns array of rank_count name indices (UNDEF if not defined) for each
+    node (row-major), names of ancestors take precedence over names of
+    descendants of the same rank (as in BtTax.getLineages). The last row is
+    the projection of taxIds which are not in nodesDB (lineage of the root).
+    Nodes are projected once, walking up iteratively to the closest
+    projected ancestor, and lineages broken by missing parents or cycles
+    are continued at the root
+    '''
+    nodes_count = len(parents)
+    raw = array('i', [UNDEF]) * (rank_count * (nodes_count + 1))
+    state = array('b', [0]) * nodes_count # 0: new, 1: on current path, 2: projected
+    if root_idx >= 0:
+        if rank_columns[root_idx] >= 0:
+            raw[rank_count * root_idx + rank_columns[root_idx]] = name_idxs[root_idx]
+            raw[rank_count * nodes_count + rank_columns[root_idx]] = name_idxs[root_idx]
+        state[root_idx] = 2
+    for node_idx in xrange(nodes_count):
+        if state[node_idx] == 2:
+            continue
+        path = []
+        while node_idx >= 0 and state[node_idx] == 0:
+            state[node_idx] = 1
+            path.append(node_idx)
+            node_idx = parents[node_idx]
+        base = node_idx if node_idx >= 0 and state[node_idx] == 2 else nodes_count
+        for node_idx in reversed(path):
+            start = rank_count * node_idx
+            raw[start:start + rank_count] = raw[rank_count * base:rank_count * base + rank_count]
+            column = rank_columns[node_idx]
+            if column >= 0 and raw[start + column] == UNDEF:
+                raw[start + column] = name_idxs[node_idx]
+            state[node_idx] = 2
+            base = node_idx
+    return raw
+
+def writeNodesDBBin(nodesDB, outfile, source_f=None):
+    '''
+    Writes nodesDB (dict of taxId : {'rank', 'name', 'parent'} or NodesDB)
+    in binary format, taxIds have to be integers. source_f is the text
+    nodesDB that nodesDB was parsed from (see getNodesDBBinSource). The file is written under
+    a temporary name and renamed, so that concurrent readers never map an
+    incomplete file
+    '''
+    taxIds = sorted(int(taxId) for taxId in nodesDB if not taxId == 'nodes_count')
+    max_taxId = taxIds[-1] if (taxIds) else 0
+    node_idxs = array('i', [-1]) * (max_taxId + 1)
+    for node_idx, taxId in enumerate(taxIds):
+        node_idxs[taxId] = node_idx
+    parents, rank_codes, name_idxs = array('i'), array('B'), array('I')
+    ranks, rank_dict = [], {}
+    name_offsets, names, name_dict = array('I', [0]), [], {}
+    def getNameIdx(name):
+        if not name in name_dict:
+            name_dict[name] = len(names)
+            names.append(name)
+            name_offsets.append(name_offsets[-1] + len(name))
+        return name_dict[name]
+    for taxId in taxIds:
+        node = nodesDB[str(taxId)]
+        parent = int(node['parent'])
+        parents.append(node_idxs[parent] if parent <= max_taxId else -1)
+        if not node['rank'] in rank_dict:
+            rank_dict[node['rank']] = len(ranks)
+            ranks.append(node['rank'])
+        rank_codes.append(rank_dict[node['rank']])
+        name_idxs.append(getNameIdx(node['name']))
+    # projection of lineages onto BtTax.RANKS
+    rank_count = len(BtTax.RANKS)
+    column_of_rank_code = [BtTax.RANKS.index(rank) if rank in BtTax.RANKS else -1 for rank in ranks]
+    rank_columns = array('b', [column_of_rank_code[rank_code] for rank_code in rank_codes])
+    root_idx = node_idxs[1] if max_taxId >= 1 else -1
+    projection = getRawProjection(parents, rank_columns, name_idxs, root_idx, rank_count)
+    undef_idx = getNameIdx('undef')
+    undef_name_idxs = {}
+    for start in xrange(0, len(projection), rank_count):
+        def_idx = None
+        for idx in xrange(start + rank_count - 1, start - 1, -1): # superkingdom to species
+            if not projection[idx] == UNDEF:
+                def_idx = projection[idx]
+            elif def_idx is None:
+                projection[idx] = undef_idx
+            else:
+                if not def_idx in undef_name_idxs:
+                    undef_name_idxs[def_idx] = getNameIdx(names[def_idx] + "-undef")
+                projection[idx] = undef_name_idxs[def_idx]
+    rank_table = "\n".join(ranks)
+    projected_rank_table = "\n".join(BtTax.RANKS)
+    source_path = os.path.abspath(source_f) if (source_f) else ''
+    source_size = os.path.getsize(source_f) if (source_f) else 0
+    tmp_f = "%s.%s.tmp" % (outfile, os.getpid())
+    with open(tmp_f, 'wb') as fh:
+        fh.write(NODESDB_HEADER.pack(NODESDB_MAGIC, len(taxIds), max_taxId, len(names), len(rank_table), len(projected_rank_table), name_offsets[-1], source_size, len(source_path)))
+        for column in [node_idxs, array('I', taxIds), parents, name_idxs, rank_codes, name_offsets, projection]:
+            column.tofile(fh)
+        fh.write(rank_table)
+        fh.write(projected_rank_table)
+        fh.write("".join(names))
+        fh.write(source_path)
+    os.rename(tmp_f, outfile)
+
+class NodesDB():
+    '''
+    Read-only view of a binary nodesDB with the interface of the nodesDB
+    dict of dicts ('taxId' in nodesDB, nodesDB['taxId']['parent'|'rank'|'name'],
+    iteration over taxIds, nodesDB['nodes_count'])
+    '''
+    def __init__(self, infile):
+        self.f = infile
+        with open(infile, 'rb') as fh:
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.nodes_count, self.max_taxId, self.names_count, ranks_size, projected_ranks_size, names_size, source_size, source_length = NODESDB_HEADER.unpack_from(self.mm, 0)
+        if not magic == NODESDB_MAGIC:
+            raise ValueError("%s is not a binary nodesDB" % infile)
+        self.node_idxs_offset = NODESDB_HEADER.size
+        self.taxIds_offset = self.node_idxs_offset + 4 * (self.max_taxId + 1)
+        self.parents_offset = self.taxIds_offset + 4 * self.nodes_count
+        self.name_idxs_offset = self.parents_offset + 4 * self.nodes_count
+        self.rank_codes_offset = self.name_idxs_offset + 4 * self.nodes_count
+        self.name_offsets_offset = self.rank_codes_offset + self.nodes_count
+        self.projection_offset = self.name_offsets_offset + 4 * (self.names_count + 1)
+        ranks_offset = self.projection_offset + 4 * (self.nodes_count + 1) * len(BtTax.RANKS)
+        projected_ranks_offset = ranks_offset + ranks_size
+        self.names_offset = projected_ranks_offset + projected_ranks_size
+        if not len(self.mm) == self.names_offset + names_size + source_length:
+            raise ValueError("%s is truncated" % infile)
+        self.ranks = self.mm[ranks_offset:projected_ranks_offset].split("\n")
+        if not self.mm[projected_ranks_offset:self.names_offset].split("\n") == BtTax.RANKS:
+            raise ValueError("Lineages of %s are not projected onto %s" % (infile, ", ".join(BtTax.RANKS)))
+        self.projection_row = struct.Struct('<%dI' % len(BtTax.RANKS))
+
+    def getNodeIdx(self, taxId):
+        '''
+        Returns index of the node of taxId (str or int), -1 if it is not in nodesDB
+        '''
+        try:
+            taxId = int(taxId)
+        except ValueError:
+            return -1
+        if taxId < 0 or taxId > self.max_taxId:
+            return -1
+        return INT32.unpack_from(self.mm, self.node_idxs_offset + 4 * taxId)[0]
+
+    def getTaxId(self, node_idx):
+        return UINT32.unpack_from(self.mm, self.taxIds_offset + 4 * node_idx)[0]
+
+    def getParentIdx(self, node_idx):
+        return INT32.unpack_from(self.mm, self.parents_offset + 4 * node_idx)[0]
+
+    def getRank(self, node_idx):
+        return self.ranks[ord(self.mm[self.rank_codes_offset + node_idx])]
+
+    def getNameIdx(self, node_idx):
+        return UINT32.unpack_from(self.mm, self.name_idxs_offset + 4 * node_idx)[0]
+
+    def getName(self, name_idx):
+        start, end = struct.unpack_from('<II', self.mm, self.name_offsets_offset + 4 * name_idx)
+        return self.mm[self.names_offset + start:self.names_offset + end]
+
+    def getLineages(self, taxIds):
+        '''
+        Returns lineages of taxIds, as BtTax.getLineages
+        '''
+        names = {}
+        lineages = {}
+        for taxId in taxIds:
+            node_idx = self.getNodeIdx(taxId)
+            row = self.projection_row.unpack_from(self.mm, self.projection_offset + self.projection_row.size * (node_idx if node_idx >= 0 else self.nodes_count))
+            for name_idx in row:
+                if not name_idx in names:
+                    names[name_idx] = self.getName(name_idx)
+            lineages[taxId] = {rank : names[name_idx] for rank, name_idx in zip(BtTax.RANKS, row)}
+        return lineages
+
+    def __contains__(self, taxId):
+        return taxId == 'nodes_count' or self.getNodeIdx(taxId) >= 0
+
+    def __getitem__(self, taxId):
+        if taxId == 'nodes_count':
+            return self.nodes_count
+        node_idx = self.getNodeIdx(taxId)
+        if node_idx < 0:
+            raise KeyError(taxId)
+        parent_idx = self.getParentIdx(node_idx)
+        return {'rank' : self.getRank(node_idx),
+                'name' : self.getName(self.getNameIdx(node_idx)),
+                'parent' : str(self.getTaxId(parent_idx)) if parent_idx >= 0 else '1'}
+
+    def __iter__(self):
+        for node_idx in xrange(self.nodes_count):
+            yield str(self.getTaxId(node_idx))
+        yield 'nodes_count'
+
+    def __len__(self):
+        return self.nodes_count + 1
+
+    def close(self):
+        self.mm.close()
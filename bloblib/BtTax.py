@@ -9,6 +9,7 @@ Author      : Dominik R. Laetsch, dominik.laetsch at gmail dot com
 from __future__ import division
 RANKS = ['species', 'genus', 'family', 'order', 'phylum', 'superkingdom']
 TAXRULES = ['bestsum', 'bestsumorder'] # this should be re-named colour rules at one point
+LINEAGES = None # lineages of worker processes, set before the pool is forked
 
 def noHit():
     return {rank : {'tax' : 'no-hit', 'score' : 0.0, 'c_index' : None} for rank in RANKS}
@@ -48,6 +49,49 @@ def getLineages(tree_lists, nodesDB):
                     lineage[tree_list_id][rank] = def_rank + "-" + lineage[tree_list_id][rank]
     return lineage
 
+def resolveLineages(taxIds, nodesDB):
+    '''
+    Returns lineages of taxIds, as getLineages(getTreeList(taxIds, nodesDB), nodesDB).
+    The names at RANKS of each node (names of ancestors taking precedence)
+    are computed once: the parent chain is walked up iteratively to the
+    closest node that is already known and the nodes on the path reuse the
+    names of their parent. Walks end at the root ('1'), at taxIds missing
+    from nodesDB and at cycles, and continue with the names of the root
+    '''
+    rank_idxs = {rank : idx for idx, rank in enumerate(RANKS)}
+    def addRank(names, node):
+        idx = rank_idxs.get(node['rank'])
+        if idx is not None and names[idx] is None:
+            names = names[:idx] + (node['name'],) + names[idx + 1:]
+        return names
+    root_names = addRank((None,) * len(RANKS), nodesDB['1'])
+    known_names = {'1' : root_names}
+    lineages = {}
+    for taxId in taxIds:
+        path, on_path = [], set()
+        thisTaxId = taxId
+        while not thisTaxId in known_names and thisTaxId in nodesDB and not thisTaxId in on_path:
+            path.append(thisTaxId)
+            on_path.add(thisTaxId)
+            thisTaxId = nodesDB[thisTaxId]['parent']
+        names = known_names.get(thisTaxId, root_names) # root_names if missing or cycle
+        for pathTaxId in reversed(path):
+            names = addRank(names, nodesDB[pathTaxId])
+            known_names[pathTaxId] = names
+        # undef is "higher_def_rank" + "-" + undef
+        lineage = {}
+        def_rank = ''
+        for rank, name in reversed(zip(RANKS, names)):
+            if name is not None:
+                def_rank = name
+                lineage[rank] = name
+            elif (def_rank):
+                lineage[rank] = def_rank + "-undef"
+            else:
+                lineage[rank] = 'undef'
+        lineages[taxId] = lineage
+    return lineages
+
 def taxRuleBestSum(taxDict, taxonomy, min_bitscore_diff, tax_collision_random):
     tempTax = { rank : {} for rank in RANKS }
     for lib in sorted(taxDict):
@@ -118,5 +162,184 @@ def getTaxDict(hits, lineages):
                 taxDict[lib][rank][name] = taxDict[lib][rank].get(name, 0.0) + score
     return taxDict
 
+def taxRules(taxrules, hits_list, lineages, min_bitscore_diff, tax_collision_random):
+    '''
+    Returns taxonomy of each (non-empty) hits of hits_list under each of
+    taxrules, as {taxrule : taxRule(taxrule, hits, ...)}.
+    Hits of all contigs are put in flat arrays (contig, lib, taxon, score),
+    with taxa integer-coded per rank in name order, and are summed per
+    contig/lib/taxon once for all taxrules. Scores are summed in the order
+    of taxRule, so sums (and ties) are identical. Ties of the top score
+    with tax_collision_random are resolved by dict order in taxRule, so
+    those contigs are left to taxRule (as are all contigs if numpy is not
+    installed)
+    '''
+    try:
+        import numpy
+    except ImportError:
+        return [{taxrule : taxRule(taxrule, hits, lineages, min_bitscore_diff, tax_collision_random) for taxrule in taxrules} for hits in hits_list]
+    from array import array
+    if not hits_list:
+        return []
+    lib_names = sorted(set(lib for hits in hits_list for lib in hits))
+    lib_codes = {lib : code for code, lib in enumerate(lib_names)}
+    taxId_codes = {}
+    contigs, libs, taxIds, scores = array('l'), array('l'), array('l'), array('d')
+    for contig, hits in enumerate(hits_list):
+        for lib in sorted(hits):
+            lib_code = lib_codes[lib]
+            for hit in hits[lib]:
+                contigs.append(contig)
+                libs.append(lib_code)
+                taxIds.append(taxId_codes.setdefault(hit['taxId'], len(taxId_codes)))
+                scores.append(hit['score'])
+    contigs = numpy.frombuffer(contigs, dtype=numpy.int_).astype(numpy.int64)
+    libs = numpy.frombuffer(libs, dtype=numpy.int_).astype(numpy.int64)
+    taxIds = numpy.frombuffer(taxIds, dtype=numpy.int_)
+    scores = numpy.frombuffer(scores, dtype=numpy.float64)
+    taxId_list = sorted(taxId_codes, key=taxId_codes.get)
+    contig_count, lib_count = len(hits_list), len(lib_names)
+    taxonomies = [{taxrule : {} for taxrule in taxrules} for hits in hits_list]
+    tied_contigs = {taxrule : set() for taxrule in taxrules}
+    for rank in RANKS:
+        names = sorted(set(lineages[taxId][rank] for taxId in taxId_list))
+        name_codes = {name : code for code, name in enumerate(names)}
+        taxon_count = len(names)
+        taxa = numpy.array([name_codes[lineages[taxId][rank]] for taxId in taxId_list], dtype=numpy.int64)[taxIds]
+        # sums of each contig/lib/taxon, in hit order (bincount adds weights in input order)
+        keys, inverse = numpy.unique((contigs * lib_count + libs) * taxon_count + taxa, return_inverse=True)
+        lib_sums = numpy.bincount(inverse, weights=scores)
+        group_contigs = keys // (lib_count * taxon_count)
+        group_libs = (keys // taxon_count) % lib_count
+        group_taxa = keys % taxon_count
+        for taxrule in set(taxrules):
+            if taxrule == 'bestsum':
+                # groups are ordered by lib within each contig/taxon, as sorted(taxDict)
+                sum_keys, sum_inverse = numpy.unique(group_contigs * taxon_count + group_taxa, return_inverse=True)
+                top_taxa, top_scores, taxa_counts, unresolved, tied = bestTaxa(sum_keys // taxon_count, sum_keys % taxon_count, numpy.bincount(sum_inverse, weights=lib_sums), min_bitscore_diff, tax_collision_random)
+                c_indices = taxa_counts - 1
+            elif taxrule == 'bestsumorder':
+                starts = numpy.flatnonzero(numpy.r_[True, group_contigs[1:] != group_contigs[:-1]])
+                first_lib = group_libs == group_libs[starts][group_contigs]
+                top_taxa, top_scores, taxa_counts, unresolved, tied = bestTaxa(group_contigs[first_lib], group_taxa[first_lib], lib_sums[first_lib], min_bitscore_diff, tax_collision_random)
+                c_indices = numpy.bincount(group_contigs[~first_lib], minlength=contig_count)
+            else:
+                for taxonomy in taxonomies:
+                    taxonomy[taxrule][rank] = {'tax' : '', 'score' : 0.0, 'c_index' : 0}
+                continue
+            if tax_collision_random:
+                tied_contigs[taxrule].update(numpy.flatnonzero(tied).tolist())
+            for contig, top_taxon, top_score, c_index, is_unresolved in zip(xrange(contig_count), top_taxa.tolist(), top_scores.tolist(), c_indices.tolist(), unresolved.tolist()):
+                taxonomies[contig][taxrule][rank] = {'tax' : 'unresolved' if is_unresolved else names[top_taxon], 'score' : top_score, 'c_index' : c_index}
+    for taxrule, contigs in tied_contigs.items():
+        for contig in contigs:
+            taxonomies[contig][taxrule] = taxRule(taxrule, hits_list[contig], lineages, min_bitscore_diff, tax_collision_random)
+    return taxonomies
+
+def taxRulesChunk(args):
+    '''
+    Worker of BlobDb.computeTaxonomy, uses the lineages LINEAGES inherited from the parent process
+    '''
+    taxrules, hits_list, min_bitscore_diff, tax_collision_random = args
+    return taxRules(taxrules, hits_list, LINEAGES, min_bitscore_diff, tax_collision_random)
+
+def bestTaxa(contigs, taxa, scores, min_bitscore_diff, tax_collision_random):
+    '''
+    Returns, for each contig (0..n-1, each with at least one taxon), the
+    top taxon (highest score, then lowest code), its score, the count of
+    taxa, whether it is 'unresolved' (as in taxRuleBestSum) and whether
+    the top score is tied
+    '''
+    import numpy
+    order = numpy.lexsort((taxa, -scores, contigs))
+    contigs, taxa, scores = contigs[order], taxa[order], scores[order]
+    starts = numpy.flatnonzero(numpy.r_[True, contigs[1:] != contigs[:-1]])
+    taxa_counts = numpy.diff(numpy.r_[starts, len(contigs)])
+    top_scores = scores[starts]
+    tied = (taxa_counts > 1) & (scores[numpy.minimum(starts + 1, len(contigs) - 1)] == top_scores)
+    # highest score below the top score is the first lower score of each contig
+    lower = numpy.flatnonzero(scores < numpy.repeat(top_scores, taxa_counts))
+    lower_contigs, first_lower = numpy.unique(contigs[lower], return_index=True)
+    unresolved = numpy.zeros(len(starts), dtype=bool)
+    unresolved[lower_contigs] = (top_scores[lower_contigs] - scores[lower[first_lower]]) <= min_bitscore_diff
+    if not tax_collision_random:
+        unresolved |= tied
+    return taxa[starts], top_scores, taxa_counts, unresolved, tied
+
+def getRandomNodesDB(nodes_count, seed=0):
+    '''
+    nodesDB of a random tree, each node descending from one of the 1000 nodes preceding it
+    '''
+    import random
+    random.seed(seed)
+    ranks = RANKS + ['class', 'subspecies', 'no rank', 'no rank']
+    nodesDB = {'1' : {'parent' : '1', 'rank' : 'no rank', 'name' : 'root'}}
+    for node in xrange(2, nodes_count + 1):
+        parent = random.randint(max(1, node - 1000), node - 1)
+        nodesDB[str(node)] = {'parent' : str(parent), 'rank' : random.choice(ranks), 'name' : 'taxon %s' % node}
+    nodesDB['nodes_count'] = nodes_count
+    return nodesDB
+
+def benchmarkLineages(nodesDB, taxIds):
+    '''
+    Seconds to compute lineages of taxIds with getTreeList/getLineages and
+    with resolveLineages
+    '''
+    import time
+    start = time.time()
+    before = getLineages(getTreeList(taxIds, nodesDB), nodesDB)
+    before_time = time.time() - start
+    start = time.time()
+    after = resolveLineages(taxIds, nodesDB)
+    after_time = time.time() - start
+    print "[INFO]\t: taxIds : %s, nodes : %s" % ('{:,}'.format(len(taxIds)), '{:,}'.format(nodesDB['nodes_count']))
+    print "[INFO]\t: getTreeList/getLineages : %.2fs" % (before_time)
+    print "[INFO]\t: resolveLineages : %.2fs" % (after_time)
+    print "[INFO]\t: Same lineages : %s" % (before == after)
+
+def getRandomHits(lineages, contig_count, hits_count, lib_count=2, seed=0):
+    '''
+    Hits of contig_count contigs with up to hits_count hits each (in one or more of lib_count libs),
+    with integer scores so that ties are frequent
+    '''
+    import random
+    random.seed(seed)
+    taxIds = sorted(lineages)
+    hits_list = []
+    for contig in xrange(contig_count):
+        hits = {}
+        for hit in xrange(random.randint(1, hits_count)):
+            lib = 'lib%s' % random.randint(1, lib_count)
+            hits.setdefault(lib, []).append({'taxId' : random.choice(taxIds), 'score' : float(random.randint(1, 100))})
+        hits_list.append(hits)
+    return hits_list
+
+def benchmarkTaxRules(lineages, hits_list, min_bitscore_diff=0.0, tax_collision_random=False):
+    '''
+    Seconds to compute bestsum and bestsumorder taxonomies of hits_list with taxRule and with taxRules
+    '''
+    import time
+    start = time.time()
+    before = [{taxrule : taxRule(taxrule, hits, lineages, min_bitscore_diff, tax_collision_random) for taxrule in TAXRULES} for hits in hits_list]
+    before_time = time.time() - start
+    start = time.time()
+    after = taxRules(TAXRULES, hits_list, lineages, min_bitscore_diff, tax_collision_random)
+    after_time = time.time() - start
+    print "[INFO]\t: contigs : %s, hits : %s" % ('{:,}'.format(len(hits_list)), '{:,}'.format(sum(len(hits) for lib_hits in hits_list for hits in lib_hits.values())))
+    print "[INFO]\t: taxRule : %.2fs" % (before_time)
+    print "[INFO]\t: taxRules : %.2fs" % (after_time)
+    print "[INFO]\t: Same taxonomies : %s" % (before == after)
+
 if __name__ == "__main__":
-    pass
+    # python -m bloblib.BtTax [NODES.DMP NAMES.DMP [TAXIDS]], TAXIDS (one per line) defaults to all nodes
+    import sys
+    if len(sys.argv) > 2:
+        import bloblib.BtIO as BtIO
+        nodesDB = BtIO.readNamesNodes(sys.argv[2], sys.argv[1])
+        taxIds = set(BtIO.parseList(sys.argv[3])) if len(sys.argv) > 3 else set(nodesDB) - set(['nodes_count'])
+    else:
+        nodesDB = getRandomNodesDB(200000)
+        taxIds = set(nodesDB) - set(['nodes_count'])
+    benchmarkLineages(nodesDB, taxIds)
+    lineages = resolveLineages(sorted(taxIds)[:1000], nodesDB)
+    benchmarkTaxRules(lineages, getRandomHits(lineages, 100000, 50))
@@ -14,7 +14,7 @@
         -e, --exclude FILE          List of contigs whose reads are excluded
                                         (if no FILE is provided ALL mapped reads
                                             are included)
-        --sort                      Sort BAM file by name
+        --sort                      Sort BAM file by name (requires samtools in $PATH)
         --keep                      Keep sorted BAM file (deleted otherwise)
         --threads INT               number of sorting/compression threads
                                     for sorting [default: 2]
@@ -2,9 +2,12 @@
 # -*- coding: utf-8 -*-
 
 """usage: blobtools create     -i FASTA [-y FASTATYPE] [-o PREFIX] [--title TITLE]
-                              [-b BAM...] [-s SAM...] [-a CAS...] [-c COV...]
+                              [-b BAM...] [-s SAM...] [-p PAF...] [-a CAS...] [-c COV...]
+                              [--depth DEPTH...] [-q FASTQ...]
                               [--nodes <NODES>] [--names <NAMES>] [--db <NODESDB>]
                               [-t HITS...] [-x TAXRULE...] [-m INT] [--tax_collision_random]
+                              [--threads INT] [--cov_stats] [--window INT]
+                              [--sample_fraction FLOAT] [--profile PROFILE...]
                               [-h|--help]
 
     Options:
@@ -30,12 +33,41 @@
         --nodes <NODES>                 NCBI nodes.dmp file. Not required if '--db'
         --names <NAMES>                 NCBI names.dmp file. Not required if '--db'
         --db <NODESDB>                  NodesDB file (default: $BLOBTOOLS/data/nodesDB.txt).
-        -b, --bam <BAM>...              BAM file(s) (requires samtools in $PATH)
-        -s, --sam <SAM>...              SAM file(s)
+        -b, --bam <BAM>...              BAM file(s)
+        -s, --sam <SAM>...              SAM file(s) ('-' reads SAM from STDIN)
+        -p, --paf <PAF>...              PAF file(s) of primary alignments (e.g. minimap2),
+                                        may be gzip'ed ('-' reads PAF from STDIN)
+        -q, --fastq <FASTQ>...          FASTQ file(s) of reads, coverage is estimated without
+                                        mapping from minimizers of the assembly, may be
+                                        gzip'ed ('-' reads FASTQ from STDIN) (requires numpy)
         -a, --cas <CAS>...              CAS file(s) (requires clc_mapping_info in $PATH)
         -c, --cov <COV>...              COV file(s)
+        --depth DEPTH...                Per-base depth of one or more samples, output of
+                                        'samtools depth -a [-H] BAM...' ('-' reads STDIN),
+                                        parsed into cov libs <DEPTH>.<SAMPLE> (e.g. depth0.1)
+                                        (requires numpy)
         -o, --out <PREFIX>              BlobDB output prefix
         --title TITLE                   Title of BlobDB [default: output prefix)
+        --threads INT                   Number of threads used for parsing
+                                        coverage and computing taxonomy [default: 1]
+        --cov_stats                     Compute median, MAD, breadth and CV of per-base
+                                        depth of each sequence from BAM/SAM file(s)
+                                        (requires numpy). For PAF and unsorted BAM/SAM
+                                        file(s), start and end of every alignment are
+                                        held in memory (16 bytes each)
+        --window INT                    Compute GC, N count and coverage (of BAM/SAM
+                                        file(s)) in windows of INT bases along each
+                                        sequence (requires numpy)
+        --sample_fraction FLOAT         Estimate coverage of BAM/SAM file(s) from this fraction
+                                        of reads (sampled by hash of read name), confidence
+                                        intervals are stored in the BlobDB [default: 1.0]
+        --profile PROFILE...            Also parse coverage of BAM/SAM file(s) from the
+                                        alignments passing each filter profile, as
+                                        library <LIB>.<PROFILE> (e.g. bam0.q30).
+                                        Criteria are combined with '+' (e.g. q30+pp)
+                                        "q<INT>"        : MAPQ >= INT
+                                        "pp"            : properly paired
+                                        "fwd"/"rev"     : forward/reverse strand
 """
 
 from __future__ import division
@@ -60,6 +92,9 @@ def main():
     bam_fs = args['--bam']
     cov_fs = args['--cov']
     cas_fs = args['--cas']
+    paf_fs = args['--paf']
+    fastq_fs = args['--fastq']
+    depth_fs = args['--depth']
     hit_fs = args['--hitsfile']
     prefix = args['--out']
     nodesDB_f = args['--db']
@@ -69,6 +104,14 @@ def main():
     min_bitscore_diff = float(args['--min_diff'])
     tax_collision_random = args['--tax_collision_random']
     title = args['--title']
+    threads = int(args['--threads'])
+    cov_stats = args['--cov_stats']
+    window_size = int(args['--window']) if (args['--window']) else None
+    sample_fraction = BtIO.parseSampleFraction(args['--sample_fraction'])
+    if (sample_fraction) and (cov_stats or window_size):
+        BtLog.error('47')
+    profiles = BtIO.parseProfiles(args['--profile'])
+    BtIO.checkNumpy([option for option in ['--cov_stats', '--window', '--depth', '--fastq'] if (args[option])])
 
     # outfile
     out_f = BtIO.getOutFile("blobDB", prefix, "json")
@@ -76,12 +119,15 @@ def main():
         title = out_f
 
     # coverage
-    if not (fasta_type) and not bam_fs and not sam_fs and not cov_fs and not cas_fs:
+    if not (fasta_type) and not bam_fs and not sam_fs and not paf_fs and not fastq_fs and not cov_fs and not cas_fs and not depth_fs:
         BtLog.error('1')
     cov_libs = [BtCore.CovLibObj('bam' + str(idx), 'bam', lib_f) for idx, lib_f in enumerate(bam_fs)] + \
            [BtCore.CovLibObj('sam' + str(idx), 'sam', lib_f) for idx, lib_f in enumerate(sam_fs)] + \
+           [BtCore.CovLibObj('paf' + str(idx), 'paf', lib_f) for idx, lib_f in enumerate(paf_fs)] + \
+           [BtCore.CovLibObj('fastq' + str(idx), 'fastq', lib_f) for idx, lib_f in enumerate(fastq_fs)] + \
            [BtCore.CovLibObj('cas' + str(idx), 'cas', lib_f) for idx, lib_f in enumerate(cas_fs)] + \
-           [BtCore.CovLibObj('cov' + str(idx), 'cov', lib_f) for idx, lib_f in enumerate(cov_fs)]
+           [BtCore.CovLibObj('cov' + str(idx), 'cov', lib_f) for idx, lib_f in enumerate(cov_fs)] + \
+           [BtCore.CovLibObj('depth' + str(idx), 'depth', lib_f) for idx, lib_f in enumerate(depth_fs)]
 
     # taxonomy
     hit_libs = [BtCore.HitLibObj('tax' + str(idx), 'tax', lib_f) for idx, lib_f in enumerate(hit_fs)]
@@ -90,7 +136,7 @@ def main():
     blobDb = BtCore.BlobDb(title)
     blobDb.version = blobtools.__version__
     # Parse FASTA
-    blobDb.parseFasta(fasta_f, fasta_type)
+    blobDb.parseFasta(fasta_f, fasta_type, window_size, threads)
 
     # Parse nodesDB OR names.dmp, nodes.dmp
     nodesDB_default = join(blobtools.DATADIR, "nodesDB.txt")
@@ -100,12 +146,12 @@ def main():
     # Parse similarity hits
     if (hit_libs):
         blobDb.parseHits(hit_libs)
-        blobDb.computeTaxonomy(taxrules, nodesDB, min_bitscore_diff, tax_collision_random)
+        blobDb.computeTaxonomy(taxrules, nodesDB, min_bitscore_diff, tax_collision_random, threads)
     else:
         print BtLog.warn_d['0']
 
     # Parse coverage
-    blobDb.parseCoverage(covLibObjs=cov_libs, no_base_cov=None)
+    blobDb.parseCoverage(covLibObjs=cov_libs, no_base_cov=None, threads=threads, cov_stats=cov_stats, sample_fraction=sample_fraction, profiles=profiles)
 
     # Generating BlobDB and writing to file
     print BtLog.status_d['7'] % out_f
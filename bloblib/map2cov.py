@@ -1,25 +1,47 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-"""usage: blobtools map2cov         -i FASTA [-b BAM...] [-a CAS...] [-s SAM...]
-                                    [-o PREFIX] [--no_base_cov]
+"""usage: blobtools map2cov         -i FASTA [-b BAM...] [-a CAS...] [-s SAM...] [-p PAF...]
+                                    [-q FASTQ...]
+                                    [-o PREFIX] [--no_base_cov] [--threads INT]
+                                    [--sample_fraction FLOAT] [--profile PROFILE...]
+                                    [-l LIST] [--merge BLOBDB]
                                     [-h|--help]
 
     Options:
         -h --help                   show this
         -i, --infile FASTA          FASTA file of assembly. Headers are split at whitespaces.
-        -b, --bam <BAM>...          BAM file (requires samtools in $PATH)
+        -b, --bam <BAM>...          BAM file
+        -q, --fastq <FASTQ>...      FASTQ file of reads, coverage is estimated without
+                                        mapping from minimizers of the assembly, may be
+                                        gzip'ed ('-' reads FASTQ from STDIN) (requires numpy)
         -a, --cas <CAS>...          CAS file (requires clc_mapping_info in $PATH)
-        -s, --sam <SAM>...          SAM file
+        -s, --sam <SAM>...          SAM file ('-' reads SAM from STDIN)
+        -p, --paf <PAF>...          PAF file of primary alignments (e.g. minimap2),
+                                        may be gzip'ed ('-' reads PAF from STDIN)
         -o, --output <PREFIX>       Output prefix
         --no_base_cov               only parse read coverage (faster, but ...
                                         can only be used for "blobtools blobplot --noblobs")
+        --threads INT               Number of threads used for parsing
+                                        coverage [default: 1]
+        --sample_fraction FLOAT     Estimate coverage from this fraction of reads
+                                        (sampled by hash of read name) [default: 1.0]
+        --profile PROFILE...        Also parse coverage of BAM/SAM file(s) from the
+                                        alignments passing each filter profile
+                                        (e.g. q30, pp, fwd, rev or q30+pp), written to
+                                        <FILE>.<PROFILE>.cov
+        -l, --list <LIST>           Only parse coverage of the sequences in LIST (file),
+                                        fetched from coordinate-sorted and indexed
+                                        BAM file(s), written to <FILE>.subset.cov
+        --merge BLOBDB              Merge coverage into the libraries of the same
+                                        name (bam0, ...) of BLOBDB, written to
+                                        <PREFIX>.<BLOBDB>
 """
 
 from __future__ import division
 from docopt import docopt
 
-from os.path import dirname, abspath
+from os.path import dirname, abspath, isfile
 from sys import path
 path.append(dirname(dirname(abspath(__file__))))
 
@@ -34,19 +56,55 @@ def main():
     bam_fs = args['--bam']
     cas_fs = args['--cas']
     sam_fs = args['--sam']
+    paf_fs = args['--paf']
+    fastq_fs = args['--fastq']
     prefix = args['--output']
     no_base_cov_flag = args['--no_base_cov']
+    threads = int(args['--threads'])
+    sample_fraction = BtIO.parseSampleFraction(args['--sample_fraction'])
+    profiles = BtIO.parseProfiles(args['--profile'])
+    seq_list_f = args['--list']
+    blobdb_f = args['--merge']
+    BtIO.checkNumpy(['--fastq'] if (fastq_fs) else [])
 
     # Make covLibs
     cov_libs = [BtCore.CovLibObj('bam' + str(idx), 'bam', lib_f) for idx, lib_f in enumerate(bam_fs)] + \
            [BtCore.CovLibObj('sam' + str(idx), 'sam', lib_f) for idx, lib_f in enumerate(sam_fs)] + \
+           [BtCore.CovLibObj('paf' + str(idx), 'paf', lib_f) for idx, lib_f in enumerate(paf_fs)] + \
+           [BtCore.CovLibObj('fastq' + str(idx), 'fastq', lib_f) for idx, lib_f in enumerate(fastq_fs)] + \
            [BtCore.CovLibObj('cas' + str(idx), 'cas', lib_f) for idx, lib_f in enumerate(cas_fs)]
     if not (cov_libs):
         BtLog.error('31')
+    if (seq_list_f) and (sam_fs or paf_fs or fastq_fs or cas_fs):
+        BtLog.error('49', ", ".join(sam_fs + paf_fs + fastq_fs + cas_fs))
+    if (blobdb_f) and not isfile(blobdb_f):
+        BtLog.error('0', blobdb_f)
     blobDb = BtCore.BlobDb('cov')
     blobDb.version = blobtools.__version__
-    blobDb.parseFasta(fasta_f, None)
-    blobDb.parseCoverage(covLibObjs=cov_libs, no_base_cov=no_base_cov_flag)
+    blobDb.parseFasta(fasta_f, None, threads=threads)
+    seqs = None
+    if (seq_list_f):
+        if not isfile(seq_list_f):
+            BtLog.error('0', seq_list_f)
+        seqs = []
+        for name in BtIO.parseList(seq_list_f):
+            if not name in blobDb.dict_of_blobs:
+                print BtLog.warn_d['2'] % (name)
+            elif not name in seqs:
+                seqs.append(name)
+    blobDb.parseCoverage(covLibObjs=cov_libs, no_base_cov=no_base_cov_flag, threads=threads, sample_fraction=sample_fraction, profiles=profiles, seqs=seqs)
+
+    if (blobdb_f):
+        print BtLog.status_d['9'] % (blobdb_f)
+        mergeDb = BtCore.BlobDb('merge')
+        mergeDb.load(blobdb_f)
+        for cov_lib_name in sorted(blobDb.covLibs):
+            covLib = blobDb.covLibs[cov_lib_name]
+            cov_f = "%s.cov" % (BtCore.getCovOutFile(covLib, seqs is not None))
+            mergeDb.mergeCov(cov_lib_name, cov_f)
+        out_f = BtIO.getOutFile(blobdb_f, prefix, "json")
+        print BtLog.status_d['7'] % out_f
+        BtIO.writeJson(mergeDb.dump(), out_f)
 
 if __name__ == '__main__':
     main()
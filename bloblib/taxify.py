@@ -90,7 +90,7 @@ def main():
     output = []
     print BtLog.status_d['1'] % ("hits file", hit_f)
 
-    with open(hit_f) as fh:
+    with BtIO.openFile(hit_f) as fh:
         for idx, l in enumerate(fh):
             query_id, bitscore, tax_id, subject_id, rest = None, None, None, None, None
             line = l.rstrip("\n").split()
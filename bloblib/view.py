@@ -3,7 +3,7 @@
 
 """usage: blobtools view    -i <BLOBDB> [-x <TAXRULE>] [--rank <TAXRANK>...] [--hits]
                             [--list <LIST>] [--out <OUT>] [--notable]
-                            [--concoct] [--cov] [--experimental]
+                            [--concoct] [--cov] [--windows] [--experimental]
                             [--h|--help]
 
     Options:
@@ -21,6 +21,9 @@
                                     that contributed to the taxonomy.
         --concoct                   Generate concoct files [default: False]
         --cov                       Generate cov files [default: False]
+        --windows                   Generate table of GC, N count and coverage in
+                                    windows along sequences (requires BlobDB
+                                    created with "--window") [default: False]
         --experimental              Experimental output [default: False]
         -n, --notable               Do not generate table view [default: False]
 """
@@ -50,6 +53,7 @@ def main():
     seq_list_f = args['--list']
     concoct = args['--concoct']
     cov = args['--cov']
+    windows = args['--windows']
     notable = args['--notable']
     experimental = args['--experimental']
     # Does blobdb_f exist ?
@@ -99,9 +103,15 @@ def main():
         viewObjs.append(concoctTaxView)
         concoctCovView = BtCore.ViewObj(name="concoct_cov", out_f=out_f, suffix="concoct_coverage_info.tsv", body=[])
         viewObjs.append(concoctCovView)
+    if (windows):
+        if not (blobDb.windows):
+            BtLog.error('45', blobdb_f)
+        windowsView = BtCore.ViewObj(name="windows", out_f=out_f, suffix="windows.txt", body=[])
+        viewObjs.append(windowsView)
     if (cov):
         for cov_lib_name, covLibDict in blobDb.covLibs.items():
-            out_f = BtIO.getOutFile(covLibDict['f'], prefix, None)
+            # filter profiles (e.g. bam0.q30) and depth samples (e.g. depth0.1) share the file of their library
+            out_f = BtCore.getCovOutFile(covLibDict, prefix=prefix)
             covView = BtCore.ViewObj(name="covlib", out_f=out_f, suffix="cov", body=[])
             blobDb.view(viewObjs=[covView], ranks=None, taxrule=None, hits_flag=None, seqs=None, cov_libs=[cov_lib_name], progressbar=True)
     if (viewObjs):